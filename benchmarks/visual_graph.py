@@ -0,0 +1,77 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Timing check of the UI results graph on synthetic reports, fails if build time grows faster than linearly with steps.
+Run from the repository root: python benchmarks/visual_graph.py
+"""
+
+import sys
+from os import path
+from random import Random
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from galloper.data_utils.visual_graph import build_graph  # noqa: E402
+
+
+class SyntheticResult:
+    """ Stand-in for UIResult with just the fields the graph is built of """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def to_json(self):
+        return dict(self.__dict__)
+
+
+def synthetic_results(steps, sessions, seed=0):
+    """ Results of a UI test with `steps` pages per session, about a third of them revisit an earlier page """
+    random = Random(seed)
+    results = []
+    for session in range(sessions):
+        for step in range(steps):
+            identifier = f"step_{random.randrange(step + 1) if random.random() < 0.3 else step}"
+            results.append(SyntheticResult(
+                id=len(results) + 1, name=identifier, session_id=f"session_{session}", identifier=identifier,
+                type="page", project_id=1, file_name=f"{identifier}_{len(results)}.html",
+                thresholds_failed=random.choice((0, 0, 1)), total=random.randrange(100, 5000)))
+    return results
+
+
+def benchmark(sizes=(500, 2000, 8000), sessions=2, repeat=3):
+    """ Best build_graph time of every number of steps, (steps, seconds) pairs """
+    timings = []
+    for steps in sizes:
+        results = synthetic_results(steps, sessions)
+        best = None
+        for _ in range(repeat):
+            started = perf_counter()
+            build_graph(1, results, "avg")
+            elapsed = perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append((steps, best))
+    return timings
+
+
+if __name__ == "__main__":
+    timings = benchmark()
+    for steps, seconds in timings:
+        print(f"{steps:>6} steps: {seconds * 1000:.1f} ms, {seconds / steps * 1e6:.1f} us per step")
+    (first_steps, first_seconds), (last_steps, last_seconds) = timings[0], timings[-1]
+    growth = (last_seconds / last_steps) / (first_seconds / first_steps)
+    print(f"per step cost grew {growth:.1f}x over {last_steps // first_steps}x more steps")
+    if growth > 4:
+        raise SystemExit("build_graph is not linear in the number of steps")
@@ -21,7 +21,7 @@ from galloper.database.models.api_release import APIRelease
 from galloper.database.models.api_reports import APIReport
 from galloper.database.models.project import Project
 from galloper.utils.api_utils import build_req_parser
-from galloper.data_utils.charts_utils import get_throughput_per_test, get_response_time_per_test
+from galloper.dal.rollups import get_throughput_per_test, get_response_time_per_test, load_rollups
 from galloper.data_utils import arrays
 
 
@@ -143,18 +143,22 @@ class ReleaseApiSaturation(Resource):
                 APIReport.release_id == release_id,
                 APIReport.name == args["test_name"],
                 APIReport.environment == args["environment"])).order_by(APIReport.vusers.asc()).all()
+            rollups = load_rollups(api_reports, request_names=['All', args["request"]])
             for _ in api_reports:
                 users.append(_.vusers)
-                errors_count = int(get_response_time_per_test(_.build_id, _.name, _.lg_type, None, 'All', "errors"))
-                total = int(get_response_time_per_test(_.build_id, _.name, _.lg_type, None, 'All', "total"))
+                errors_count = int(get_response_time_per_test(_.build_id, _.name, _.lg_type, None, 'All', "errors",
+                                                              rollups=rollups))
+                total = int(get_response_time_per_test(_.build_id, _.name, _.lg_type, None, 'All', "total",
+                                                       rollups=rollups))
                 global_error_rate.append(round(float(errors_count / total) * 100, 2))
                 throughput.append(get_throughput_per_test(
                     _.build_id, _.name, _.lg_type, args["sampler"], args["request"],
-                    args["aggregation"], args["status"]))
+                    args["aggregation"], args["status"], rollups=rollups))
                 response_time.append(get_response_time_per_test(
-                    _.build_id, _.name, _.lg_type, args["sampler"], args["request"], "pct95", args["status"]))
+                    _.build_id, _.name, _.lg_type, args["sampler"], args["request"], "pct95", args["status"],
+                    rollups=rollups))
                 error_rate.append(get_response_time_per_test(
-                    _.build_id, _.name, _.lg_type, args["sampler"], args["request"], "errors"))
+                    _.build_id, _.name, _.lg_type, args["sampler"], args["request"], "errors", rollups=rollups))
             if arrays.non_decreasing(throughput) and error_rate[-1] <= float(args["max_errors"]):
                 return {"message": "proceed", "users": users, "error_rate": int(global_error_rate[-1]), "code": 0}
             elif error_rate[-1] > float(args["max_errors"]):
@@ -5,7 +5,6 @@ from uuid import uuid4
 from datetime import datetime
 from time import mktime
 from json import dumps
-from requests import post
 from sqlalchemy import and_
 from galloper.database.models.task import Task
 from galloper.database.models.project import Project
@@ -15,6 +14,7 @@ from galloper.processors.minio import MinioClient
 from galloper.constants import JOB_CONTAINER_MAPPING, APP_HOST, RABBIT_USER, RABBIT_PASSWORD, RABBIT_PORT,\
     RABBIT_QUEUE_NAME, RABBIT_HOST
 from galloper.dal.vault import get_project_secrets, unsecret, get_project_hidden_secrets
+from galloper.utils.http import get_session
 
 from werkzeug.exceptions import Forbidden
 from werkzeug.utils import secure_filename
@@ -138,5 +138,5 @@ def check_tasks_quota(task):
         auth_token = unsecret("{{secret.auth_token}}", project_id=task['project_id'])
         if auth_token:
             headers['Authorization'] = f'bearer {auth_token}'
-        post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
+        get_session().post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
         raise Forbidden(description="The number of task executions allowed in the project has been exceeded")
@@ -15,16 +15,20 @@
 
 from datetime import datetime, timezone
 from json import loads
+from traceback import format_exc
+from flask import Response, current_app, request
 from flask_restful import Resource
 from sqlalchemy import and_
-from statistics import mean, harmonic_mean
 from uuid import uuid4
-from galloper.dal.influx_results import get_test_details, delete_test_data, get_aggregated_test_results,\
-    get_tps, get_errors, get_response_time_per_test, get_backend_users, get_backend_requests
+from galloper.dal.influx_results import get_test_details, delete_test_data, get_aggregated_test_results
+from galloper.dal.rollups import build_rollups, delete_rollups
 from galloper.data_utils.charts_utils import (
-    requests_summary, requests_hits, avg_responses, summary_table, get_issues, get_data_from_influx,
+    requests_summary, requests_hits, avg_responses, summary_table, get_issues, get_issues_count, get_data_from_influx,
     prepare_comparison_responses, compare_tests, create_benchmark_dataset
 )
+from galloper.data_utils.live_metrics import stream_events
+from galloper.data_utils.report_utils import CHART_JS, COLUMNAR
+from galloper.database.db_manager import db_session
 from galloper.database.models.api_reports import APIReport
 from galloper.database.models.api_baseline import APIBaseline
 from galloper.database.models.performance_tests import PerformanceTests
@@ -33,10 +37,19 @@ from galloper.database.models.statistic import Statistic
 from galloper.database.models.project_quota import ProjectQuota
 from galloper.api.base import get, run_task
 from galloper.utils.api_utils import build_req_parser
-from galloper.constants import str_to_timestamp
-from galloper.data_utils import arrays
+from galloper.constants import str_to_timestamp, LIVE_STREAM_MAX_AGE
+from galloper.data_utils.saturation import get_saturation_data, analyse
 from galloper.dal.vault import get_project_secrets, get_project_hidden_secrets
 
+COLUMNAR_MIMETYPE = "application/vnd.galloper.columnar+json"
+
+
+def chart_format(args):
+    """ Columnar charts are sent when asked for by format=columnar or by Accept header """
+    if args.get("format") == COLUMNAR or COLUMNAR_MIMETYPE in request.headers.get("Accept", ""):
+        return COLUMNAR
+    return CHART_JS
+
 
 class ReportAPI(Resource):
     get_rules = (
@@ -172,6 +185,12 @@ class ReportAPI(Resource):
         report.vusers = args["vusers"]
         report.duration = args["duration"]
         report.commit()
+        try:
+            build_rollups(report)
+        except Exception:  # pylint: disable=W0703
+            # the test is finished anyway, rollups are backfilled when the build is looked at next time
+            db_session.rollback()
+            current_app.logger.error(format_exc())
         return {"message": "updated"}
 
     def delete(self, project_id: int):
@@ -182,6 +201,7 @@ class ReportAPI(Resource):
         ).all()
         for each in query_result:
             delete_test_data(each.build_id, each.name, each.lg_type)
+            delete_rollups(each.build_id)
             baseline = APIBaseline.query.filter_by(project_id=project.id, report_id=each.id).first()
             if baseline:
                 baseline.delete()
@@ -263,7 +283,9 @@ class ReportChartsAPI(Resource):
         dict(name="build_id", type=str, location="args"),
         dict(name="test_name", type=str, location="args"),
         dict(name="lg_type", type=str, location="args"),
-        dict(name='status', type=str, default='all', location="args")
+        dict(name='status', type=str, default='all', location="args"),
+        dict(name="cursor", type=str, default=None, location="args"),
+        dict(name="format", type=str, default=CHART_JS, location="args")
     )
     mapping = {
         "requests": {
@@ -274,7 +296,8 @@ class ReportChartsAPI(Resource):
             "data": get_data_from_influx
         },
         "errors": {
-            "table": get_issues
+            "table": get_issues,
+            "count": get_issues_count
         }
     }
 
@@ -286,9 +309,36 @@ class ReportChartsAPI(Resource):
 
     def get(self, source: str, target: str):
         args = self._parser_get.parse_args(strict=False)
+        args["format"] = chart_format(args)
         return self.mapping[source][target](args)
 
 
+class ReportChartsStreamAPI(Resource):
+    get_rules = (
+        dict(name="build_id", type=str, required=True, location="args"),
+        dict(name="test_name", type=str, required=True, location="args"),
+        dict(name="lg_type", type=str, required=True, location="args"),
+        dict(name="start_time", type=str, required=True, location="args"),
+        dict(name="sampler", type=str, default="REQUEST", location="args")
+    )
+
+    def __init__(self):
+        self.__init_req_parsers()
+
+    def __init_req_parsers(self):
+        self._parser_get = build_req_parser(rules=self.get_rules)
+
+    def get(self):
+        args = self._parser_get.parse_args(strict=False)
+        events = stream_events(args["build_id"], args["test_name"], args["lg_type"], args["start_time"],
+                               args["sampler"])
+        if events is None:
+            return {"message": "Too many live streams, poll charts with cursor instead"}, 503, \
+                {"Retry-After": str(LIVE_STREAM_MAX_AGE)}
+        return Response(events, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 class ReportsCompareAPI(Resource):
     get_rules = (
         dict(name="low_value", type=float, default=0, location="args"),
@@ -303,7 +353,8 @@ class ReportsCompareAPI(Resource):
         dict(name="request", type=str, default="", location="args"),
         dict(name="calculation", type=str, default="", location="args"),
         dict(name="aggregator", type=str, default="1s", location="args"),
-        dict(name='status', type=str, default='all', location="args")
+        dict(name='status', type=str, default='all', location="args"),
+        dict(name="format", type=str, default=CHART_JS, location="args")
     )
     mapping = {
         "data": prepare_comparison_responses,
@@ -319,6 +370,7 @@ class ReportsCompareAPI(Resource):
 
     def get(self, target: str):
         args = self._parser_get.parse_args(strict=False)
+        args["format"] = chart_format(args)
         return self.mapping[target](args)
 
 
@@ -395,15 +447,6 @@ class TestSaturation(Resource):
     def __init_req_parsers(self):
         self._parser_get = build_req_parser(rules=self._rules)
 
-    @staticmethod
-    def part(data, part):
-        data = sorted(data)
-        n = len(data)
-        if n <= part or part == 1:
-            return data[-1]
-        parts = n // part
-        return data[parts * (part-1)]
-
     def get(self):
         args = self._parser_get.parse_args(strict=False)
         project = Project.get_or_404(args["project_id"])
@@ -420,166 +463,11 @@ class TestSaturation(Resource):
         duration_till_now = current_time - start_time
         if duration_till_now < args['wait_till']:
             return {"message": "not enough results", "code": 0}
-        ts_array, data, users = get_tps(report.build_id, report.name, report.lg_type, str_start_time, str_current_time,
-                                        "1s", args["sampler"], scope=args["request"], status=args["status"])
-        users = list(users["users"].values())
-        _tmp = []
-        tps = list()
-        usrs = list()
-        errors = list()
-        if 'm' in args["aggregation"]:
-            ss = int(args["aggregation"].replace('m', '')) * 60
-        elif 's' in args["aggregation"]:
-            ss = int(args["aggregation"].replace('s', ''))
-        else:
-            ss = 60
-        calculation_mapping = {
-            'max': max,
-            'min': min,
-            'mean': mean,
-            'sum': sum
-        }
-        calculation = args['calculation'] if args['calculation'] in list(calculation_mapping.keys()) else 'sum'
-        for index, _ in enumerate(data["responses"].values()):
-            if isinstance(_, int):
-                _tmp.append(_)
-            if len(_tmp) and (len(_tmp) % ss) == 0:
-                tps.append(round(calculation_mapping[calculation](_tmp)))
-                usrs.append(users[index])
-                _tmp = []
-        if _tmp:
-            tps.append(round(calculation_mapping[calculation](_tmp)))
-            usrs.append(users[-1])
-            _tmp = []
-        _, data, _ = get_errors(report.build_id, report.name, report.lg_type, str_start_time, str_current_time,
-                                args["aggregation"], args["sampler"], scope=args["request"])
-        for each in data['errors'].values():
-            if each:
-                errors.append(each)
-        total = int(get_response_time_per_test(report.build_id, report.name, report.lg_type, args["sampler"],
-                                               args["request"], "total"))
-        error_rate = float(sum(errors))/float(total) * 100
-        try:
-            max_tp, user_index = arrays.non_decreasing(tps[:-1], deviation=args["deviation"], val=True)
-            max_users = args["u_aggr"] * round(usrs[user_index]/args["u_aggr"])
-            max_tp = tps[user_index]
-            current_users = args["u_aggr"] * round(usrs[user_index+1]/args["u_aggr"])
-            if current_users == max_users:
-                current_users += args["u_aggr"]
-            if current_users == 0:
-                current_users = max_users + args["u_aggr"]
-            if current_users < max_users:
-                current_users = max_users + args["u_aggr"]
-        except TypeError:
+        series, errors = get_saturation_data(report, args["sampler"], args["request"], args["status"],
+                                             args["aggregation"], str_start_time, str_current_time)
+        if not len(series):
             return {"message": "not enough results", "code": 0}
-        except IndexError:
-            if error_rate > args["max_errors"]:
-                return {"message": f"error rate reached 100% for {args['request']} transaction", "errors_rate": 100.0,
-                        "code": 1}
-            else:
-                return {"message": "not enough results", "code": 0}
-
-        response = {
-            "ts": ts_array[-1],
-            "max_users": max_users,
-            "max_throughput": round(max_tp, 2),
-            "current_users": current_users,
-            "current_throughput": round(tps[user_index], 2),
-            "errors_rate": round(error_rate, 2)
-        }
-        if args["u"]:
-            user_array = args["u"]
-            if max_users not in user_array:
-                user_array.append(max_users)
-            if current_users not in user_array:
-                user_array.append(current_users)
-            user_array.sort()
-            user_array.reverse()
-            uber_array = {}
-            _, users = get_backend_users(report.build_id, report.lg_type, str_start_time, str_current_time, "1s")
-            u = user_array.pop()
-            start_time = _[0]
-            end_time = _[-1]
-            response["test_start"] = start_time
-            response["test_end"] = end_time
-            for key, value in users["users"].items():
-                if value > u and max_users >= u:
-                    _, data, _ = get_tps(report.build_id, report.name, report.lg_type, start_time, key,
-                                         "1s", args["sampler"], scope=args["request"],
-                                         status=args["status"])
-                    tp = [0 if v is None else v for v in list(data['responses'].values())[:-1]]
-                    array_size = len(tp)
-                    tp = calculation_mapping[calculation](tp) if len(tp) != 0 else 0
-                    if array_size != ss:
-                        coefficient = float(array_size/ss)
-                    else:
-                        coefficient = 1
-                    tp = int(tp / coefficient)
-                    if round(tp, 2) > response["max_throughput"] and u != current_users:
-                        response["max_throughput"] = round(tp, 2)
-                        response["max_users"] = u
-                        current_users = u + args["u_aggr"]
-                        response["current_users"] = current_users
-                    _, data, _ = get_backend_requests(report.build_id, report.name, report.lg_type,
-                                                      start_time, key, "1s", args["sampler"], scope=args["request"],
-                                                      status=args["status"])
-                    rt = []
-                    started = False
-                    for v in list(data['response'].values())[:-1]:
-                        if v and v > 0:
-                            started = True
-                        if started and v and v > 0:
-                            rt.append(v)
-                    rt = self.part(rt, args["u_aggr"]) if rt else 0
-                    uber_array[str(u)] = {
-                        "throughput": round(tp, 2),
-                        "response_time": round(rt, 2)
-                    }
-                    start_time = key
-                    u = user_array.pop()
-            if str(response["max_users"]) not in list(uber_array.keys()):
-                _, data, _ = get_backend_requests(report.build_id, report.name, report.lg_type,
-                                                  start_time, end_time, "1s", args["sampler"], scope=args["request"],
-                                                  status=args["status"])
-                rt = []
-                started = False
-                for v in list(data['response'].values())[:-1]:
-                    if v and v > 0:
-                        started = True
-                    if started and v and v > 0:
-                        rt.append(v)
-                rt = self.part(rt, args["u_aggr"]) if rt else 0
-                uber_array[str(max_users)] = {
-                    "throughput": response["max_throughput"],
-                    "response_time": round(rt, 2)
-                }
-            else:
-                uber_array[str(response["max_users"])]["throughput"] = response["max_throughput"]
-            if str(current_users) not in list(uber_array.keys()):
-
-                uber_array[str(current_users)] = {
-                    "throughput": response["current_throughput"],
-                    "response_time": uber_array.get(str(max_users), list(uber_array.values())[-1])["response_time"]
-                }
-            else:
-                uber_array[str(current_users)]["throughput"] = response["current_throughput"]
-            response["benchmark"] = uber_array
-        if args["extended_output"]:
-            response["details"] = {}
-            response["tps"] = tps
-            for index, value in enumerate(usrs):
-                if not response["details"].get(value) or response["details"][value] > tps[index]:
-                    response["details"][value] = tps[index]
-        if (arrays.non_decreasing(tps[:-1], deviation=args["deviation"]) and
-                error_rate <= args["max_errors"] and
-                response["current_throughput"] * (1 + args["max_deviation"]) >= response["max_throughput"]):
-            response["message"] = "proceed"
-            response["code"] = 0
-            return response
-        else:
-            response["message"] = "saturation"
-            response["code"] = 1
-            return response
+        return analyse(series, errors, args)
 
 
 
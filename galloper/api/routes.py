@@ -22,9 +22,9 @@ from .observer_result import UIResultsAPI, UIResultsStepAPI
 from .project import ProjectAPI, ProjectSessionAPI
 from .project_quota import ProjectQuotaAPI
 from .project_secrets import ProjectSecretsAPI, ProjectSecretAPI
-from .report import ReportAPI, ReportChartsAPI, ReportsCompareAPI, BaselineAPI, TestSaturation, ReportPostProcessingAPI
+from .report import ReportAPI, ReportChartsAPI, ReportChartsStreamAPI, ReportsCompareAPI, BaselineAPI, TestSaturation, ReportPostProcessingAPI
 from .report_status import ReportStatusAPI
-from .security_report import SecurityReportAPI, FindingsAPI, FindingsAnalysisAPI
+from .security_report import SecurityReportAPI, FindingsAPI, FindingsDetailsAPI, FindingsAnalysisAPI, FindingsTrendAPI
 from .planner import TestsApiPerformance, TestApiBackend, TestApi
 from .ui_planner import UITestsApiPerformance, TestApiFrontend
 from .security_planner import SecuritySeedDispatcher
@@ -54,12 +54,15 @@ def initialize_api_routes(api: Api):
     add_resource_to_api(api, ReportStatusAPI, "/reports/<int:project_id>/<string:report_type>/<int:report_id>/status")
     add_resource_to_api(api, ReportPostProcessingAPI, "/reports/<int:project_id>/processing")
     add_resource_to_api(api, ReportChartsAPI, "/chart/<string:source>/<string:target>")
+    add_resource_to_api(api, ReportChartsStreamAPI, "/chart/stream")
     add_resource_to_api(api, ReportsCompareAPI, "/compare/<string:target>")
     add_resource_to_api(api, TestSaturation, "/saturation")
 
     add_resource_to_api(api, SecurityReportAPI, "/security/<int:project_id>")
     add_resource_to_api(api, FindingsAPI, "/security/<int:project_id>/finding")
+    add_resource_to_api(api, FindingsDetailsAPI, "/security/<int:project_id>/finding/details")
     add_resource_to_api(api, FindingsAnalysisAPI, "/security/<int:project_id>/fpa")
+    add_resource_to_api(api, FindingsTrendAPI, "/security/<int:project_id>/trend")
 
     add_resource_to_api(api, ProjectAPI, "/project", "/project/<int:project_id>")
     add_resource_to_api(api, ProjectSessionAPI, "/project-session", "/project-session/<int:project_id>")
@@ -12,15 +12,15 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-import hashlib
 from datetime import datetime
 from json import loads
-import operator
 
-from flask import request, current_app
+from flask import request
 from flask_restful import Resource
 from sqlalchemy import or_, and_
 
+from galloper.dal.findings import (application_filter, findings_trend, get_details, ingest_findings, triage_issues,
+                                   unknown_details, upload_details, UnknownDetails)
 from galloper.database.models.project import Project
 from galloper.database.models.security_details import SecurityDetails
 from galloper.database.models.security_reports import SecurityReport
@@ -149,7 +149,13 @@ class FindingsAPI(Resource):
     get_rules = (
         dict(name="id", type=int, location="args"),
         dict(name="type", type=str, location="args"),
-        dict(name="filter", type=str, default="", location="args")
+        dict(name="filter", type=str, default="", location="args"),
+        dict(name="search", type=str, default="", location="args"),
+        dict(name="sort", type=str, default="", location="args"),
+        dict(name="order", type=str, default="asc", location="args"),
+        dict(name="offset", type=int, default=0, location="args"),
+        dict(name="limit", type=int, default=0, location="args"),
+        dict(name="details", type=str, default="full", location="args")
     )
     put_rules = (
         dict(name="id", type=int, location="json"),
@@ -182,61 +188,49 @@ class FindingsAPI(Resource):
             filter_.append(SecurityReport.excluded_finding == 1)
         if args.get("filter"):
             for key, value in loads(args.get("filter")).items():
-                filter_.append(getattr(SecurityReport, key).like(f"%{value}%"))
+                if key in SecurityReport.__table__.columns:
+                    filter_.append(getattr(SecurityReport, key).like(f"%{value}%"))
+        if args.get("search"):
+            filter_.append(or_(SecurityReport.description.like(f"%{args['search']}%"),
+                               SecurityReport.tool_name.like(f"%{args['search']}%"),
+                               SecurityReport.severity.like(f"%{args['search']}%"),
+                               SecurityReport.endpoints.like(f"%{args['search']}%")))
         filter_ = and_(*tuple(filter_))
-        issues = SecurityReport.query.filter(filter_).all()
+        if args.get("sort") in SecurityReport.__table__.columns and args["order"] in ("asc", "desc"):
+            sort_rule = getattr(getattr(SecurityReport, args["sort"]), args["order"])()
+        else:
+            sort_rule = SecurityReport.id.asc()
+        query = SecurityReport.query.filter(filter_).outerjoin(
+            SecurityDetails, SecurityDetails.id == SecurityReport.details
+        ).add_columns(SecurityDetails.detail_hash).order_by(sort_rule)
+        if args["limit"]:
+            total = query.count()
+            query = query.limit(args["limit"]).offset(args["offset"])
+        issues = query.all()
+        # details are loaded at once here or later on by hash from FindingsDetailsAPI
+        if args["details"] == "hash":
+            details = {}
+        else:
+            details = get_details(project_id, [detail_hash for _, detail_hash in issues if detail_hash])
         results = []
-        for issue in issues:
+        for issue, detail_hash in issues:
             _res = issue.to_json()
-            _res["details"] = SecurityDetails.query.filter_by(id=_res["details"]).first().details
+            if args["details"] == "hash":
+                _res["detail_hash"] = detail_hash
+            else:
+                _res["details"] = details.get(detail_hash)
             results.append(_res)
+        if args["limit"]:
+            return {"total": total, "rows": results}
         return results
 
     def post(self, project_id: int):
-        finding_db = None
-        for finding in request.json:
-            md5 = hashlib.md5(finding["details"].encode("utf-8")).hexdigest()
-            hash_id = SecurityDetails.query.filter(
-                and_(SecurityDetails.project_id == project_id, SecurityDetails.detail_hash == md5)
-            ).first()
-            if not hash_id:
-                hash_id = SecurityDetails(detail_hash=md5, project_id=project_id, details=finding["details"])
-                hash_id.insert()
-            # Verify issue is false_positive or ignored
-            finding["details"] = hash_id.id
-            finding['project_id'] = project_id
-            entrypoints = ""
-            if finding.get("endpoints"):
-                for each in finding.get("endpoints"):
-                    if isinstance(each, list):
-                        entrypoints += "<br />".join(each)
-                    else:
-                        entrypoints += f"<br />{each}"
-            finding["endpoints"] = entrypoints
-            issue = SecurityReport.query.filter(and_(
-                SecurityReport.project_id == project_id,
-                SecurityReport.issue_hash == finding['issue_hash'])).first()
-            if issue:
-                finding['severity'] = issue.severity
-            if not (finding["false_positive"] == 1 or finding["excluded_finding"] == 1):
-                # TODO: add validation that finding is a part of project, application. etc.
-                issues = SecurityReport.query.filter(
-                    and_(SecurityReport.project_id == project_id,
-                         SecurityReport.issue_hash == finding["issue_hash"],
-                         or_(SecurityReport.false_positive == 1,
-                             SecurityReport.excluded_finding == 1)
-                         )).all()
-                false_positive = sum(issue.false_positive for issue in issues)
-                excluded_finding = sum(issue.excluded_finding for issue in issues)
-                finding["false_positive"] = 1 if false_positive > 0 else 0
-                finding["excluded_finding"] = 1 if excluded_finding > 0 else 0
-            finding_db = SecurityReport(**finding)
-            finding_db.add()
-        if finding_db:
-            finding_db.commit()
+        try:
+            ingest_findings(project_id, request.json)
+        except UnknownDetails as e:
+            return {"message": "Details are not uploaded", "unknown": e.hashes}, 400
 
     def put(self, project_id: int):
-        # TODO: this thing need to be reworked, as it will be slow as hell
         args = self._parser_put.parse_args(strict=False)
         issues_id = []
         if args["issue_id"]:
@@ -252,37 +246,46 @@ class FindingsAPI(Resource):
         else:
             return {"message": "Action is invalid"}, 400
 
-        for issue_id in issues_id:
-            issue_hash = SecurityReport.query.filter(and_(SecurityReport.project_id == project_id,
-                                                          SecurityReport.id == issue_id)
-                                                     ).first().issue_hash
-            SecurityReport.query.filter(and_(
-                SecurityReport.project_id == project_id,
-                SecurityReport.issue_hash == issue_hash)
-            ).update(upd)
-            SecurityReport.commit()
-            if args["action"] in ("false_positive", "excluded_finding", "valid"):
-                reports = SecurityReport.query.filter(and_(
-                    SecurityReport.project_id == project_id,
-                    SecurityReport.issue_hash == issue_hash)
-                ).with_entities(SecurityReport.report_id).distinct()
-                for report in reports:
-                    false_positive = SecurityReport.query.filter(and_(
-                        SecurityReport.report_id == report.report_id,
-                        SecurityReport.false_positive == 1)
-                    ).count()
-                    ignored = SecurityReport.query.filter(and_(
-                        SecurityReport.report_id == report.report_id,
-                        SecurityReport.excluded_finding == 1)
-                    ).count()
-                    findings = SecurityReport.query.filter(and_(
-                        SecurityReport.report_id == report.report_id)
-                    ).count()
-                    SecurityResults.query.filter(
-                        SecurityResults.id == report.report_id
-                    ).update({"false_positives": false_positive, "excluded": ignored,
-                              "findings": findings-(false_positive+ignored)})
-                    SecurityResults.commit()
+        triage_issues(project_id, issues_id, upd,
+                      recount=args["action"] in ("false_positive", "excluded_finding", "valid"))
+        return {"message": "accepted"}
+
+
+class FindingsDetailsAPI(Resource):
+    """
+    Details of findings by md5 hash. Scanners post hashes of their findings details first,
+    put only the ones reported unknown and then post findings with detail_hash instead of details.
+    """
+    get_rules = (
+        dict(name="hash[]", type=str, action="append", default=[], location="args"),
+    )
+    post_rules = (
+        dict(name="hashes", type=list, default=[], location="json"),
+    )
+
+    def __init__(self):
+        self.__init_req_parsers()
+
+    def __init_req_parsers(self):
+        self._parser_get = build_req_parser(rules=self.get_rules)
+        self._parser_post = build_req_parser(rules=self.post_rules)
+
+    def get(self, project_id: int):
+        args = self._parser_get.parse_args(strict=False)
+        return get_details(project_id, args["hash[]"])
+
+    def post(self, project_id: int):
+        args = self._parser_post.parse_args(strict=False)
+        return {"unknown": unknown_details(project_id, args["hashes"])}
+
+    def put(self, project_id: int):
+        details = request.json
+        if not isinstance(details, dict) or not all(
+                isinstance(md5, str) and isinstance(text, str) for md5, text in details.items()):
+            return {"message": "Details are expected as an object of hash to details text"}, 400
+        rejected = upload_details(project_id, details)
+        if rejected:
+            return {"message": "Details do not match their hashes", "rejected": rejected}, 400
         return {"message": "accepted"}
 
 
@@ -302,12 +305,8 @@ class FindingsAnalysisAPI(Resource):
 
     def get(self, project_id: int):
         args = self._parser_get.parse_args(strict=False)
-        projects_filter = and_(SecurityResults.project_id == project_id,
-                               SecurityResults.project_name == args["project_name"],
-                               SecurityResults.app_name == args["app_name"],
-                               SecurityResults.scan_type == args["scan_type"])
-        ids = SecurityResults.query.filter(projects_filter).all()
-        ids = [each.id for each in ids]
+        projects_filter = application_filter(project_id, args["project_name"], args["app_name"], args["scan_type"])
+        ids = SecurityResults.query.with_entities(SecurityResults.id).filter(projects_filter).subquery()
         if args["type"] == "ignored":
             hashes = SecurityReport.query.filter(
                 and_(SecurityReport.excluded_finding == 1, SecurityReport.report_id.in_(ids))
@@ -317,3 +316,26 @@ class FindingsAnalysisAPI(Resource):
                 and_(SecurityReport.false_positive == 1, SecurityReport.report_id.in_(ids))
                 ).with_entities(SecurityReport.issue_hash).distinct()
         return [_.issue_hash for _ in hashes]
+
+
+class FindingsTrendAPI(Resource):
+    get_rules = (
+        dict(name="project_name", type=str, location="args"),
+        dict(name="app_name", type=str, location="args"),
+        dict(name="scan_type", type=str, location="args"),
+        dict(name="limit", type=int, default=0, location="args")
+    )
+
+    def __init__(self):
+        self.__init_req_parsers()
+
+    def __init_req_parsers(self):
+        self._parser_get = build_req_parser(rules=self.get_rules)
+
+    def get(self, project_id: int):
+        args = self._parser_get.parse_args(strict=False)
+        if args["limit"] is None or args["limit"] < 0:
+            return {"message": "limit must be a non-negative number of scans"}, 400
+        trend = findings_trend(project_id, args["project_name"], args["app_name"], args["scan_type"])
+        # limit 0 stands for all the scans
+        return trend[-args["limit"]:] if args["limit"] > 0 else trend
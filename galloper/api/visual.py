@@ -1,5 +1,4 @@
 import io
-import itertools
 import zipfile
 from typing import Optional
 from uuid import uuid4
@@ -11,7 +10,7 @@ from flask import current_app
 from traceback import format_exc
 
 from galloper.api.base import get
-from galloper.data_utils.arrays import get_aggregated_data, closest
+from galloper.data_utils.visual_graph import build_graph
 from galloper.database.models.project import Project
 from galloper.database.models.ui_report import UIReport
 from galloper.database.models.ui_result import UIResult
@@ -164,25 +163,6 @@ class VisualResultAPI(Resource):
                 continue
         return {"message": "Done"}
 
-    def assert_threshold(self, results, aggregation, metric="total"):
-        graph_aggregation = {}
-        for result in results:
-            if result.identifier in graph_aggregation.keys():
-                graph_aggregation[result.identifier].append(result)
-            else:
-                graph_aggregation[result.identifier] = [result]
-
-        threshold_results = {}
-        for name, values in graph_aggregation.items():
-            aggregated_total = get_aggregated_data(aggregation, values, metric)
-            result = closest(values, aggregated_total)
-            thresholds_failed = sum([d.thresholds_failed for d in values])
-            status = "passed"
-            if thresholds_failed > 0:
-                status = "failed"
-            threshold_results[name] = {"status": status, "data": result, "time": aggregated_total}
-        return threshold_results
-
     def build_table(self, results, base_url):
         table = []
         for result in results:
@@ -226,128 +206,4 @@ class VisualResultAPI(Resource):
         return table
 
     def build_graph(self, project_id, results, aggregation, loops, metric="total"):
-        edges = []
-        nodes = self.get_nodes(results)
-        flow = self.get_flow(results)
-        threshold_results = self.assert_threshold(results, aggregation, metric)
-
-        for session, steps in flow.items():
-            for curr, upcoming in self.pairwise(steps):
-                current_node = self.find_node(curr, nodes)
-                upcoming_node = self.find_node(upcoming, nodes)
-                if self.is_edge_exists(current_node, upcoming_node, edges):
-                    continue
-
-                edge = self.make_edge(current_node, upcoming_node)
-                edges.append(edge)
-
-        for node in nodes:
-            result = self.find_result(node, results)
-            if not result:
-                continue
-
-            threshold_result = threshold_results[result.identifier]
-            status = threshold_result['status']
-            result = threshold_result['data']
-            time = round(threshold_result['time'] / 1000, 2)
-            node['status'] = status
-            node['file'] = f"/api/v1/artifacts/{project_id}/reports/{result.file_name}"
-
-            edge = self.find_edge(result, edges)
-            if len(edge) == 1:
-                edge[0]['data']['time'] = time
-                edge[0]["classes"] = status
-            if len(edge) > 1:
-                edge[0]['data']['time'] = time
-                edge[0]["classes"] = status
-
-        return nodes, edges
-
-    def find_result(self, node, results):
-        res = list(filter(lambda r: r.id == node['data']['id'], results))
-        if len(res) == 1:
-            return res[0]
-        return None
-
-    def get_flow(self, steps):
-        flows = {}
-        start = {"data": {"id": 'start', "name": 'Start', "identifier": "start_point", "session_id": "start"}}
-        for step in steps:
-            curr_session_id = step.session_id
-            if curr_session_id in flows.keys():
-                flows[curr_session_id].append(self.result_to_node(step))
-            else:
-                flows[curr_session_id] = [start, self.result_to_node(step)]
-        return flows
-
-    def get_nodes(self, steps):
-        nodes = [
-            {"data": {"id": 'start', "name": 'Start', "identifier": "start_point", "session_id": "start"}}
-        ]
-        for result in steps:
-            current_node = self.find_if_exists(result, nodes)
-            if not current_node:
-                current_node = self.result_to_node(result)
-                nodes.append(current_node)
-        return nodes
-
-    def find_if_exists(self, curr_node, node_list):
-        res = list(filter(lambda x: x['data']['identifier'] == curr_node.identifier, node_list))
-        if len(res) == 1:
-            return res[0]
-        if len(res) > 1:
-            raise Exception("Bug! Node duplication")
-        return None
-
-    def find_node(self, curr_node, node_list):
-        if curr_node['data']['identifier'] == 'start_point':
-            return curr_node
-
-        res = list(filter(lambda x: x['data']['identifier'] == curr_node['data']['identifier'], node_list))
-        if len(res) == 1:
-            return res[0]
-        if len(res) > 1:
-            raise Exception("Bug! Node duplication")
-        return None
-
-    def find_edge(self, res, edges):
-        res = list(filter(lambda x: x['data']['id_to'] == res.identifier, edges))
-        return res
-
-    def is_edge_exists(self, node1, node2, edges):
-        res = list(
-            filter(lambda e: e['data']['source'] == node1['data']['id'] and e['data']['target'] == node2['data']['id'],
-                   edges))
-        return len(res) > 0
-
-    def result_to_node(self, res):
-        return {
-            "data": {
-                "id": res.id,
-                "name": res.name,
-                "session_id": res.session_id,
-                "identifier": res.identifier,
-                "type": res.type,
-                "status": "passed",
-                "result_id": res.id,
-                "file": f"/api/v1/artifacts/{res.project_id}/reports/{res.file_name}"
-            }
-        }
-
-    def make_edge(self, node_from, node_to):
-        return {
-            "data": {
-                "source": node_from['data']['id'],
-                "target": node_to['data']['id'],
-                "session_id": node_from['data']['session_id'],
-                "id_to": node_to['data']['identifier'],
-                "time": ""
-            },
-            "classes": ""
-        }
-
-    def pairwise(self, iterable):
-        "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-        a, b = itertools.tee(iterable)
-        next(b, None)
-        return zip(a, b)
+        return build_graph(project_id, results, aggregation, metric)
@@ -24,7 +24,6 @@ from celery import Celery
 from celery.contrib.abortable import AbortableTask
 from croniter import croniter
 from docker.types import Mount
-from requests import post
 
 from galloper.constants import (REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT, REDIS_USER,
                                 UNZIP_DOCKERFILE, UNZIP_DOCKER_COMPOSE, APP_HOST, NAME_CONTAINER_MAPPING)
@@ -34,6 +33,7 @@ from galloper.database.models.statistic import Statistic
 from galloper.database.models.project_quota import ProjectQuota
 from werkzeug.exceptions import Forbidden
 from galloper.dal.vault import unsecret
+from galloper.utils.http import get_session
 
 app = Celery('Galloper',
              broker=f'redis://{REDIS_USER}:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
@@ -82,7 +82,7 @@ def run_lambda(task, event):
     auth_token = unsecret("{{secret.auth_token}}", project_id=task['project_id'])
     if auth_token:
         headers['Authorization'] = f'bearer {auth_token}'
-    post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
+    get_session().post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
     return results
 
 
@@ -118,7 +118,7 @@ def execute_lambda(self, task, event, *args, **kwargs):
         auth_token = unsecret("{{secret.auth_token}}", project_id=task['project_id'])
         if auth_token:
             headers['Authorization'] = f'bearer {auth_token}'
-        post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
+        get_session().post(f'{APP_HOST}/api/v1/task/{task["task_id"]}/results', headers=headers, data=dumps(data))
         raise Forbidden(description="The number of task executions allowed in the project has been exceeded")
     statistic = db_session.query(Statistic).filter(Statistic.project_id == task['project_id']).first()
     setattr(statistic, 'tasks_executions', Statistic.tasks_executions + 1)
@@ -14,6 +14,7 @@
 
 from os import environ
 from datetime import datetime
+from functools import lru_cache
 from urllib.parse import urlparse
 
 LOCAL_DEV = False
@@ -35,6 +36,11 @@ GF_API_KEY = environ.get('GF_API_KEY', '')
 INFLUX_PASSWORD = environ.get('INFLUX_PASSWORD', '')
 INFLUX_USER = environ.get('INFLUX_USER', '')
 INFLUX_PORT = 8086
+INFLUX_POOL_SIZE = int(environ.get('INFLUX_POOL_SIZE', 10))
+INFLUX_CLIENT_TTL = int(environ.get('INFLUX_CLIENT_TTL', 300))
+BUILD_PROJECT_CACHE_SIZE = 4096
+BUILD_PROJECT_CACHE_TTL = 3600
+BUILD_PROJECT_NEGATIVE_TTL = 10
 LOKI_PORT = 3100
 _url = urlparse(APP_HOST)
 EXTERNAL_LOKI_HOST = f"http://{_url.netloc.split('@')[1]}" if "@" in APP_HOST else APP_HOST.replace("https://",
@@ -49,9 +55,49 @@ MINIO_ACCESS = environ.get('MINIO_ACCESS_KEY', 'admin')
 MINIO_SECRET = environ.get('MINIO_SECRET_KEY', 'password')
 MINIO_REGION = environ.get('MINIO_REGION', 'us-east-1')
 LOKI_HOST = environ.get('LOKI', 'http://carrier-loki:3100')
+LOKI_PAGE_SIZE = 5000
+LOKI_MAX_ISSUES = 1000
+HTTP_POOL_SIZE = int(environ.get('HTTP_POOL_SIZE', 20))
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.3
+# connect and read timeouts, seconds
+HTTP_TIMEOUT = (5, 60)
+AUTH_CACHE_SIZE = 2048
+AUTH_CACHE_TTL = int(environ.get('AUTH_CACHE_TTL', 30))
 MAX_DOTS_ON_CHART = 500
+RESULTS_CACHE_TTL = int(environ.get('RESULTS_CACHE_TTL', 7 * 24 * 3600))
+RESULTS_CACHE_DIR = environ.get('RESULTS_CACHE_DIR', '/tmp/results_cache')
+# bytes, oldest results are dropped from RESULTS_CACHE_DIR above it, pruned at most once per interval in seconds
+RESULTS_CACHE_MAX_SIZE = int(environ.get('RESULTS_CACHE_MAX_SIZE', 512 * 1024 * 1024))
+RESULTS_CACHE_PRUNE_INTERVAL = 60
+# kept apart from REDIS_DB used by celery broker and backend
+RESULTS_CACHE_REDIS_DB = environ.get('RESULTS_CACHE_REDIS_DB', 3)
+# seconds, charts are computed without the cache rather than waiting for a stuck Redis
+RESULTS_CACHE_REDIS_TIMEOUT = float(environ.get('RESULTS_CACHE_REDIS_TIMEOUT', 0.5))
+LIVE_CACHE_SIZE = 256
+LIVE_CACHE_TTL = 3600
+LIVE_POLL_INTERVAL = int(environ.get('LIVE_POLL_INTERVAL', 5))
+LIVE_KEEPALIVE_INTERVAL = 15
+# every stream holds a worker thread, the rest of them are left for the other requests
+LIVE_MAX_STREAMS = int(environ.get('LIVE_MAX_STREAMS', 2))
+# seconds, streams are ended after it and EventSource reconnects by itself
+LIVE_STREAM_MAX_AGE = int(environ.get('LIVE_STREAM_MAX_AGE', 300))
+# seconds since the last point after which a build which was never finished is not polled any more
+LIVE_STALE_AFTER = int(environ.get('LIVE_STALE_AFTER', 600))
+# seconds of delivered live data queried again on refresh, points written late by slow flushes are caught up
+LIVE_OVERLAP = int(environ.get('LIVE_OVERLAP', 30))
+ROLLUP_AGGREGATIONS = ("1s", "30s")
+# tag sets per Influx request when building rollups, 3 statements each
+ROLLUP_BATCH_SIZE = 4
+# threads per process shared by all the requests fanning out work, capped by half of the DB pool
+FAN_OUT_WORKERS = int(environ.get('FAN_OUT_WORKERS', 4))
 VAULT_URL = environ.get('VAULT_URL', 'http://127.0.0.1:8200' if LOCAL_DEV else 'http://carrier-vault:8200')
 VAULT_DB_PK = 1
+VAULT_CACHE_TTL = int(environ.get('VAULT_CACHE_TTL', 60))
+VAULT_CACHE_SIZE = int(environ.get('VAULT_CACHE_SIZE', 512))
+VAULT_TOKEN_TTL = int(environ.get('VAULT_TOKEN_TTL', 600))
+VAULT_CACHE_PUBSUB = environ.get('VAULT_CACHE_PUBSUB', 'false').lower() in ('true', 'yes', '1')
+VAULT_CACHE_CHANNEL = environ.get('VAULT_CACHE_CHANNEL', 'galloper_vault_invalidate')
 GRID_ROUTER_URL = environ.get("GRID_ROUTER_URL", f"{EXTERNAL_LOKI_HOST}:4444/quota")
 
 NAME_CONTAINER_MAPPING = {
@@ -135,13 +181,14 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@lru_cache(maxsize=4096)
 def str_to_timestamp(str_ts):
-    timestamp = str_ts.replace("Z", "")
-    if "." not in timestamp:
-        timestamp += "."
-    timestamp += "".join(["0" for _ in range(26 - len(timestamp))])
-    timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f").timestamp()
-    return timestamp
+    """ '2021-01-01T10:00:00.123Z' -> epoch seconds, the time is taken as naive just like strptime does """
+    timestamp, _, fraction = str_ts.replace("Z", "").partition(".")
+    timestamp = datetime.fromisoformat(timestamp)
+    if fraction:
+        timestamp = timestamp.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+    return timestamp.timestamp()
 
 
 UNZIP_DOCKERFILE = """FROM kubeless/unzip:latest
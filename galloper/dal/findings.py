@@ -0,0 +1,262 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Set based ingestion of security findings, a handful of queries per scan instead of a few per finding """
+
+import hashlib
+import zlib
+
+from sqlalchemy import and_, case, func, or_, select
+
+from galloper.database.db_manager import db_session
+from galloper.database.models.security_details import SecurityDetails
+from galloper.database.models.security_reports import SecurityReport
+from galloper.database.models.security_results import SecurityResults
+
+# keeps IN lists under bind parameters limits of every supported database
+IN_CHUNK_SIZE = 500
+
+
+class UnknownDetails(Exception):
+    """ Findings refer to details which were never uploaded """
+
+    def __init__(self, hashes):
+        super().__init__(f"Unknown details: {', '.join(map(str, hashes))}")
+        self.hashes = hashes
+
+
+def chunks(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def detail_hash(details):
+    return hashlib.md5(details.encode("utf-8")).hexdigest()
+
+
+def format_endpoints(endpoints):
+    entrypoints = ""
+    for each in endpoints or []:
+        if isinstance(each, list):
+            entrypoints += "<br />".join(each)
+        else:
+            entrypoints += f"<br />{each}"
+    return entrypoints
+
+
+def pack_details(details):
+    """
+    (details, compressed) column values, every details text is zlib compressed on its own.
+    Plain text is kept where compression does not pay off.
+    """
+    data = details.encode("utf-8")
+    packed = zlib.compress(data, 9)
+    if len(packed) >= len(data):
+        return details, None
+    return None, packed
+
+
+def unpack_details(details, compressed):
+    if compressed is None:
+        return details
+    return zlib.decompress(bytes(compressed)).decode("utf-8")
+
+
+def get_detail_ids(project_id, hashes):
+    """ detail_hash -> SecurityDetails.id of the ones already stored """
+    ids = {}
+    for chunk in chunks(hashes):
+        ids.update(SecurityDetails.query.with_entities(SecurityDetails.detail_hash, SecurityDetails.id).filter(
+            and_(SecurityDetails.project_id == project_id, SecurityDetails.detail_hash.in_(chunk))
+        ))
+    return ids
+
+
+def get_details(project_id, hashes):
+    """ detail_hash -> details text, loaded with chunked IN queries """
+    details = {}
+    for chunk in chunks(set(hashes)):
+        for md5, text, compressed in SecurityDetails.query.with_entities(
+                SecurityDetails.detail_hash, SecurityDetails.details, SecurityDetails.compressed).filter(
+                and_(SecurityDetails.project_id == project_id, SecurityDetails.detail_hash.in_(chunk))):
+            details[md5] = unpack_details(text, compressed)
+    return details
+
+
+def store_details(project_id, details):
+    """ Insert details missing in the project, returns detail_hash -> SecurityDetails.id of all of them """
+    ids = get_detail_ids(project_id, details)
+    missing = [dict(zip(("details", "compressed"), pack_details(text)), project_id=project_id, detail_hash=md5)
+               for md5, text in details.items() if md5 not in ids]
+    if missing:
+        db_session.bulk_insert_mappings(SecurityDetails, missing)
+        ids.update(get_detail_ids(project_id, [each["detail_hash"] for each in missing]))
+    return ids
+
+
+def unknown_details(project_id, hashes):
+    """ Hashes of the details which are not stored in the project yet, the ones scanner has to upload """
+    hashes = set(hashes)
+    return sorted(hashes - get_detail_ids(project_id, hashes).keys())
+
+
+def upload_details(project_id, details):
+    """ Store uploaded detail_hash -> details, returns hashes which do not match their details and were skipped """
+    rejected = [md5 for md5, text in details.items() if detail_hash(text) != md5]
+    store_details(project_id, {md5: text for md5, text in details.items() if md5 not in rejected})
+    db_session.commit()
+    return rejected
+
+
+def get_issues_state(project_id, issue_hashes):
+    """
+    issue_hash -> (severity, false_positive, excluded_finding) of already reported issues.
+    Severity is the one of the first report of the issue, flags are set if any of the reports has them set.
+    """
+    state = {}
+    for chunk in chunks(issue_hashes):
+        grouped = SecurityReport.query.with_entities(
+            SecurityReport.issue_hash, func.min(SecurityReport.id), func.max(SecurityReport.false_positive),
+            func.max(SecurityReport.excluded_finding)
+        ).filter(
+            and_(SecurityReport.project_id == project_id, SecurityReport.issue_hash.in_(chunk))
+        ).group_by(SecurityReport.issue_hash).all()
+        severities = dict(SecurityReport.query.with_entities(SecurityReport.id, SecurityReport.severity).filter(
+            SecurityReport.id.in_([first_id for _, first_id, _, _ in grouped])
+        ))
+        for issue_hash, first_id, false_positive, excluded_finding in grouped:
+            state[issue_hash] = (severities.get(first_id), 1 if false_positive else 0, 1 if excluded_finding else 0)
+    return state
+
+
+def ingest_findings(project_id, findings):
+    """
+    Store scan findings: details are deduplicated by md5 within the project, severity and
+    false positive / excluded marks are inherited from earlier reports of the same issue.
+    Findings may carry detail_hash instead of details, if those were uploaded beforehand.
+    Everything is written in one transaction.
+    """
+    details = {}
+    for finding in findings:
+        md5 = finding.pop("detail_hash", None)
+        if "details" in finding:
+            md5 = detail_hash(finding["details"])
+            details.setdefault(md5, finding["details"])
+        finding["details"] = md5
+    uploaded = {finding["details"] for finding in findings} - details.keys()
+    detail_ids = get_detail_ids(project_id, uploaded)
+    if uploaded - detail_ids.keys():
+        raise UnknownDetails(sorted(uploaded - detail_ids.keys(), key=str))
+    detail_ids.update(store_details(project_id, details))
+    issues = get_issues_state(project_id, {finding["issue_hash"] for finding in findings})
+    mappings = []
+    for finding in findings:
+        finding["details"] = detail_ids[finding["details"]]
+        finding["project_id"] = project_id
+        finding["endpoints"] = format_endpoints(finding.get("endpoints"))
+        severity, false_positive, excluded_finding = issues.get(finding["issue_hash"], (None, 0, 0))
+        if severity:
+            finding["severity"] = severity
+        if not (finding["false_positive"] == 1 or finding["excluded_finding"] == 1):
+            # TODO: add validation that finding is a part of project, application. etc.
+            finding["false_positive"] = false_positive
+            finding["excluded_finding"] = excluded_finding
+        # later findings of the same issue in this scan see this one as already reported
+        issues[finding["issue_hash"]] = (
+            severity or finding.get("severity"),
+            1 if finding["false_positive"] == 1 else false_positive,
+            1 if finding["excluded_finding"] == 1 else excluded_finding
+        )
+        mappings.append(finding)
+    if mappings:
+        db_session.bulk_insert_mappings(SecurityReport, mappings)
+    db_session.commit()
+    return len(mappings)
+
+
+def recount_reports(report_ids):
+    """ Recompute findings, false positives and excluded counters of the reports with one grouped query """
+    counters = []
+    for chunk in chunks(report_ids):
+        counters.extend(SecurityReport.query.with_entities(
+            SecurityReport.report_id,
+            func.sum(case([(SecurityReport.false_positive == 1, 1)], else_=0)),
+            func.sum(case([(SecurityReport.excluded_finding == 1, 1)], else_=0)),
+            func.count(SecurityReport.id)
+        ).filter(SecurityReport.report_id.in_(chunk)).group_by(SecurityReport.report_id))
+    db_session.bulk_update_mappings(SecurityResults, [
+        {"id": report_id, "false_positives": false_positive, "excluded": ignored,
+         "findings": findings - (false_positive + ignored)}
+        for report_id, false_positive, ignored, findings in counters
+    ])
+
+
+def triage_issues(project_id, issues_id, upd, recount=False):
+    """ Apply upd to every report of the issues, all at once and in one transaction """
+    hashes = set()
+    for chunk in chunks(issues_id):
+        hashes.update(issue_hash for issue_hash, in SecurityReport.query.with_entities(
+            SecurityReport.issue_hash).filter(
+            and_(SecurityReport.project_id == project_id, SecurityReport.id.in_(chunk))
+        ).distinct())
+    report_ids = set()
+    for chunk in chunks(hashes):
+        issues_filter = and_(SecurityReport.project_id == project_id, SecurityReport.issue_hash.in_(chunk))
+        SecurityReport.query.filter(issues_filter).update(upd, synchronize_session=False)
+        if recount:
+            report_ids.update(report_id for report_id, in SecurityReport.query.with_entities(
+                SecurityReport.report_id).filter(issues_filter).distinct())
+    if report_ids:
+        recount_reports(report_ids)
+    db_session.commit()
+
+
+def application_filter(project_id, project_name, app_name, scan_type):
+    return and_(SecurityResults.project_id == project_id, SecurityResults.project_name == project_name,
+                SecurityResults.app_name == app_name, SecurityResults.scan_type == scan_type)
+
+
+def findings_trend(project_id, project_name, app_name, scan_type):
+    """
+    New, fixed and persisting issues of every scan of the application compared to its previous scan,
+    false positives and excluded findings are not counted. All computed by one windowed query.
+    """
+    scans = select([
+        SecurityResults.id, SecurityResults.scan_time,
+        func.row_number().over(order_by=SecurityResults.id).label("rn")
+    ]).where(application_filter(project_id, project_name, app_name, scan_type)).cte("scans")
+    issues = select([SecurityReport.issue_hash, scans.c.rn]).select_from(
+        SecurityReport.__table__.join(scans, SecurityReport.report_id == scans.c.id)
+    ).where(and_(SecurityReport.false_positive == 0, SecurityReport.excluded_finding == 0)).distinct().cte("issues")
+    # scan numbers where the issue was seen last time before and first time after this scan
+    window = dict(partition_by=issues.c.issue_hash, order_by=issues.c.rn)
+    marks = select([
+        issues.c.rn, func.lag(issues.c.rn).over(**window).label("prev_rn"),
+        func.lead(issues.c.rn).over(**window).label("next_rn")
+    ]).cte("marks")
+    seen_before = and_(marks.c.rn == scans.c.rn, marks.c.prev_rn == scans.c.rn - 1)
+    trend = select([
+        scans.c.id, scans.c.scan_time,
+        func.sum(case([(and_(marks.c.rn == scans.c.rn, or_(marks.c.prev_rn.is_(None),
+                                                           marks.c.prev_rn != scans.c.rn - 1)), 1)], else_=0)),
+        func.sum(case([(and_(marks.c.rn == scans.c.rn - 1, or_(marks.c.next_rn.is_(None),
+                                                               marks.c.next_rn != scans.c.rn)), 1)], else_=0)),
+        func.sum(case([(seen_before, 1)], else_=0))
+    ]).select_from(
+        scans.outerjoin(marks, or_(marks.c.rn == scans.c.rn, marks.c.rn == scans.c.rn - 1))
+    ).group_by(scans.c.id, scans.c.scan_time, scans.c.rn).order_by(scans.c.rn)
+    return [{"id": report_id, "scan_time": scan_time, "new": new or 0, "fixed": fixed or 0,
+             "persisting": persisting or 0}
+            for report_id, scan_time, new, fixed, persisting in db_session.execute(trend)]
@@ -0,0 +1,55 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Helpers to build InfluxQL queries which fold series into buckets on the Influx side """
+
+
+def time_range(start_time, end_time):
+    return f"time>='{start_time}' and time<='{end_time}'"
+
+
+def where(*conditions):
+    return " and ".join(condition.strip() for condition in conditions if condition and condition.strip())
+
+
+def bucketed(select, source, conditions, interval, fill=None, group_by=None):
+    """
+    :param select: - aggregate expression, e.g. 'count(status)'
+    :param source: - measurement or subquery
+    :param conditions: - list of where conditions, empty ones are skipped
+    :param interval: - bucket size, e.g. '30s' or '1m'
+    :param fill: - InfluxQL fill option for buckets without data, Influx default (null) if not set
+    :param group_by: - tags to group by besides time
+    :return: query string
+    """
+    query = f"select {select} from {source} where {where(*conditions)} group by "
+    if group_by:
+        query += f"{group_by}, "
+    query += f"time({interval})"
+    if fill is not None:
+        query += f" fill({fill})"
+    return query
+
+
+def users_query(build_id, project_id, lg_type, start_time, end_time, aggregation):
+    """
+    Active users summed over load generators for every second, then max per aggregation bucket.
+    Per second sums are needed as generators report at different moments.
+    """
+    per_lg = f"(select max(\"active\") from {lg_type}_{project_id}..\"users_{aggregation}\" " \
+             f"where build_id='{build_id}' group by lg_id)"
+    per_second = bucketed("sum(\"max\")", per_lg, [time_range(start_time, end_time)], "1s")
+    if aggregation == "1s":
+        return f"{per_second} fill(0)"
+    return bucketed("max(\"sum\")", f"({per_second})", [time_range(start_time, end_time)], aggregation, fill=0)
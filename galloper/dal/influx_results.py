@@ -12,23 +12,83 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from threading import Lock
+from time import monotonic
 from influxdb import InfluxDBClient
-from datetime import datetime, timezone
-from galloper.constants import str_to_timestamp, MAX_DOTS_ON_CHART
-from galloper.dal.vault import get_project_hidden_secrets, get_project_secrets
+from galloper.constants import (str_to_timestamp, MAX_DOTS_ON_CHART, INFLUX_PORT, INFLUX_POOL_SIZE, INFLUX_CLIENT_TTL,
+                                BUILD_PROJECT_CACHE_SIZE, BUILD_PROJECT_CACHE_TTL, BUILD_PROJECT_NEGATIVE_TTL)
+from galloper.dal.results_cache import purge_results
+from galloper.dal.vault import get_project_hidden_secrets, get_project_secrets, on_project_secrets_change
 from galloper.database.models.api_reports import APIReport
+from galloper.dal.influx_query import bucketed, time_range, users_query
+from galloper.data_utils.series import Series, aggregation_to_seconds
+from galloper.utils.cache import TTLCache
 from flask import current_app
 
+# (project_id, db_name) -> (client, credentials, expires_at)
+_clients = {}
+_clients_lock = Lock()
+# build_id -> project_id, None is cached for unknown builds
+_build_projects = TTLCache(maxsize=BUILD_PROJECT_CACHE_SIZE, ttl=BUILD_PROJECT_CACHE_TTL)
+_NOT_CACHED = object()
 
-def get_client(project_id, db_name=None):
+
+def _get_credentials(project_id):
     secrets = get_project_secrets(project_id)
     hidden_secrets = get_project_hidden_secrets(project_id)
     influx_host = secrets.get("influx_ip") if "influx_ip" in secrets else hidden_secrets.get("influx_ip", "")
     influx_user = secrets.get("influx_user") if "influx_user" in secrets else hidden_secrets.get("influx_user", "")
     influx_password = secrets.get("influx_password") if "influx_password" in secrets else \
         hidden_secrets.get("influx_password", "")
+    return influx_host, influx_user, influx_password
+
+
+def get_client(project_id, db_name=None):
+    """ Get pooled Influx client, credentials are re-checked in Vault every INFLUX_CLIENT_TTL seconds """
+    key = (int(project_id), db_name)
+    with _clients_lock:
+        entry = _clients.get(key)
+    if entry and entry[2] > monotonic():
+        return entry[0]
+    credentials = _get_credentials(project_id)
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry and entry[1] == credentials:
+            client = entry[0]
+        else:
+            # the replaced client is not closed, other threads may still be querying with it,
+            # its connections go away along with it once they are done
+            influx_host, influx_user, influx_password = credentials
+            client = InfluxDBClient(influx_host, INFLUX_PORT, influx_user, influx_password, db_name,
+                                    pool_size=INFLUX_POOL_SIZE)
+        _clients[key] = (client, credentials, monotonic() + INFLUX_CLIENT_TTL)
+    return client
+
+
+def close_project_clients(project_id):
+    """ Close and forget all pooled clients of the project """
+    with _clients_lock:
+        keys = [key for key in _clients if key[0] == int(project_id)]
+        entries = [_clients.pop(key) for key in keys]
+    for client, _, _ in entries:
+        client.close()
+
 
-    return InfluxDBClient(influx_host, 8086, influx_user, influx_password, db_name)
+def _expire_project_clients(project_id):
+    """ Force credentials re-check on next get_client call """
+    with _clients_lock:
+        for key, (client, credentials, _) in list(_clients.items()):
+            if key[0] == project_id:
+                _clients[key] = (client, credentials, 0)
+
+
+on_project_secrets_change(_expire_project_clients)
+
+
+def query_batch(project_id, queries, db_name=None):
+    """ Run several InfluxQL statements in a single HTTP request, result sets are returned in the same order """
+    results = get_client(project_id, db_name).query(";".join(queries))
+    return results if isinstance(results, list) else [results]
 
 
 def create_project_databases(project_id):
@@ -47,6 +107,7 @@ def drop_project_databases(project_id):
     client = get_client(project_id)
     for each in db_list:
         client.query(f"drop database {each}")
+    close_project_clients(project_id)
 
 
 def get_test_details(project_id, build_id, test_name, lg_type):
@@ -83,15 +144,16 @@ def get_test_details(project_id, build_id, test_name, lg_type):
     q_type = f"show tag values on comparison_{project_id} with key=\"test_type\" where build_id='{build_id}'"
     q_requests_name = f"show tag values on comparison_{project_id} with key=\"request_name\" " \
                       f"where build_id='{build_id}'"
-    client = get_client(project_id)
-    test["start_time"] = list(client.query(q_start_time)["users"])[0]["time"]
-    test["end_time"] = list(client.query(q_end_time)["users"])[0]["time"]
+    start_time, end_time, total_users, env, test_type, requests_name, response_codes = query_batch(
+        project_id, [q_start_time, q_end_time, q_total_users, q_env, q_type, q_requests_name, q_response_codes])
+    test["start_time"] = list(start_time["users"])[0]["time"]
+    test["end_time"] = list(end_time["users"])[0]["time"]
     test["duration"] = round(str_to_timestamp(test["end_time"]) - str_to_timestamp(test["start_time"]), 1)
-    test["vusers"] = list(client.query(q_total_users)["api_comparison"])[0]["value"]
-    test["environment"] = list(client.query(q_env)["api_comparison"])[0]["value"]
-    test["type"] = list(client.query(q_type)["api_comparison"])[0]["value"]
-    test["requests"] = [name["value"] for name in client.query(q_requests_name)["api_comparison"]]
-    response_data = list(client.query(q_response_codes)['api_comparison'])[0]
+    test["vusers"] = list(total_users["api_comparison"])[0]["value"]
+    test["environment"] = list(env["api_comparison"])[0]["value"]
+    test["type"] = list(test_type["api_comparison"])[0]["value"]
+    test["requests"] = [name["value"] for name in requests_name["api_comparison"]]
+    response_data = list(response_codes['api_comparison'])[0]
     test['total'] = response_data['Total']
     test['failures'] = response_data['KO']
     test['throughput'] = round(response_data['throughput'], 1)
@@ -104,22 +166,20 @@ def get_test_details(project_id, build_id, test_name, lg_type):
 
 
 def calculate_auto_aggregation(build_id, test_name, lg_type, start_time, end_time):
+    """
+    The finest aggregation which keeps the chart around MAX_DOTS_ON_CHART points. Number of points is estimated
+    from a single count over the 1s measurement, as every coarser measurement holds proportionally fewer of them.
+    """
     project_id = get_project_id(build_id)
-    client = get_client(project_id)
-    aggregation = "1s"
     aggr_list = ["1s", "5s", "30s", "1m", "5m", "10m"]
-    for i in range(len(aggr_list)):
-        aggr = aggr_list[i]
-        query = f"select sum(\"count\") from (select count(pct95) from {lg_type}_{project_id}..{test_name}_{aggr} " \
-                f"where time>='{start_time}' and time<='{end_time}' and build_id='{build_id}' group by time({aggr}))"
-        result = list(client.query(query)[f"{test_name}_{aggr}"])
-        if result:
-            if int(result[0]["sum"]) > MAX_DOTS_ON_CHART and aggregation != "10m":
-                aggregation = aggr_list[i + 1]
-            if int(result[0]["sum"]) == 0 and aggregation != "1s":
-                aggregation = "30s"
-                break
-    return aggregation
+    query = f"select count(pct95) from {lg_type}_{project_id}..{test_name}_1s " \
+            f"where {time_range(start_time, end_time)} and build_id='{build_id}'"
+    result = list(get_client(project_id).query(query)[f"{test_name}_1s"])
+    points = int(result[0]["count"]) if result else 0
+    for aggr in aggr_list:
+        if points / aggregation_to_seconds(aggr) <= MAX_DOTS_ON_CHART:
+            return aggr
+    return aggr_list[-1]
 
 
 def get_sampler_types(project_id, build_id, test_name, lg_type):
@@ -128,28 +188,27 @@ def get_sampler_types(project_id, build_id, test_name, lg_type):
     return [each["value"] for each in list(client.query(q_samplers)[f"{test_name}_1s"])]
 
 
+def _users_series(res, aggregation):
+    users = Series.from_points(res, 'sum' if aggregation == '1s' else 'max')
+    return users.unique_timestamps(), {"users": users.align(users.unique_timestamps())}
+
+
+def _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation, query,
+                      timestamps=None, users=None):
+    """ Run the query, users series is fetched within the same request unless it is passed in """
+    if timestamps and users:
+        return timestamps, users, get_client(project_id).query(query)
+    users_res, res = query_batch(project_id, [
+        users_query(build_id, project_id, lg_type, start_time, end_time, aggregation), query])
+    timestamps, users = _users_series(users_res[f'users_{aggregation}'], aggregation)
+    return timestamps, users, res
+
+
 def get_backend_users(build_id, lg_type, start_time, end_time, aggregation):
     project_id = get_project_id(build_id)
-    query = f"select sum(\"max\") from (select max(\"active\") from {lg_type}_{project_id}..\"users_{aggregation}\" " \
-            f"where build_id='{build_id}' group by lg_id) " \
-            f"WHERE time>='{start_time}' and time<='{end_time}' GROUP BY time(1s)"
-    client = get_client(project_id)
-    res = client.query(query)[f'users_{aggregation}']
-    timestamps = []
-    results = {"users": {}}
-    # aggregation of users
-    _tmp = []
-    if 'm' in aggregation:
-        aggregation = f"{str(int(aggregation.replace('m', ''))*60)}s"
-    for _ in res:
-        _tmp.append(_['sum'] if _['sum'] else 0)
-        results["users"][_['time']] = None
-        if _['time'] not in timestamps:
-            timestamps.append(_['time'])
-        if (len(_tmp) % int(aggregation.replace('s', ''))) == 0:
-            results["users"][_['time']] = max(_tmp)
-            _tmp = []
-    return timestamps, results
+    query = users_query(build_id, project_id, lg_type, start_time, end_time, aggregation)
+    res = get_client(project_id).query(query)[f'users_{aggregation}']
+    return _users_series(res, aggregation)
 
 
 def get_backend_requests(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
@@ -177,12 +236,12 @@ def get_backend_requests(build_id, test_name, lg_type, start_time, end_time, agg
     if status != 'all':
         status_addon = f" and status='{status.upper()}'"
 
-    if not (timestamps and users):
-        timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
     query = f"select time, {group_by}percentile(\"{aggr}\", 95) as rt from {lg_type}_{project_id}..{test_name}_{aggregation} " \
             f"where time>='{start_time}' and time<='{end_time}' {status_addon} and sampler_type='{sampler}' and " \
             f"build_id='{build_id}' {scope_addon} group by {group_by}time({aggregation})"
-    res = get_client(project_id).query(query)[f"{test_name}_{aggregation}"]
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               query, timestamps, users)
+    res = res[f"{test_name}_{aggregation}"]
     results = {}
     if group_by:
         for _ in res:
@@ -253,8 +312,6 @@ def get_throughput_per_test(build_id, test_name, lg_type, sampler, scope, aggreg
 def get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
             timestamps=None, users=None, scope=None, status='all'):
     project_id = get_project_id(build_id)
-    if not (timestamps and users):
-        timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
     scope_addon = ""
     status_addon = ""
     if scope and scope != 'All':
@@ -265,7 +322,9 @@ def get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sam
                       f" where time>='{start_time}' " \
                       f"and time<='{end_time}' and sampler_type='{sampler}' {status_addon} and build_id='{build_id}' " \
                       f"{scope_addon} group by time({aggregation})"
-    res = get_client(project_id).query(responses_query)[f"{test_name}_{aggregation}"]
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               responses_query, timestamps, users)
+    res = res[f"{test_name}_{aggregation}"]
     results = {"responses": {}}
     for _ in timestamps:
         results['responses'][_] = None
@@ -277,8 +336,6 @@ def get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sam
 def get_response_codes(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
                        timestamps=None, users=None, scope=None, aggr="2xx", status='all'):
     project_id = get_project_id(build_id)
-    if not (timestamps and users):
-        timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
     scope_addon = ""
     status_addon = " "
     if scope and scope != 'All':
@@ -289,7 +346,9 @@ def get_response_codes(build_id, test_name, lg_type, start_time, end_time, aggre
                   f" where build_id='{build_id}' " \
                   f"and sampler_type='{sampler}' and time>='{start_time}' and time<='{end_time}'{status_addon} " \
                   f"{scope_addon}group by time({aggregation})"
-    res = get_client(project_id).query(rcode_query)[f"{test_name}_{aggregation}"]
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               rcode_query, timestamps, users)
+    res = res[f"{test_name}_{aggregation}"]
     results = {"rcodes": {}}
     for _ in timestamps:
         results['rcodes'][_] = None
@@ -301,73 +360,39 @@ def get_response_codes(build_id, test_name, lg_type, start_time, end_time, aggre
 def get_errors(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
                timestamps=None, users=None, scope=None):
     project_id = get_project_id(build_id)
-    if not (timestamps and users):
-        timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
-    scope_addon = ""
+    conditions = [time_range(start_time, end_time), f"sampler_type='{sampler}'", f"build_id='{build_id}'",
+                  "status='KO'"]
     if scope and scope != 'All':
-        scope_addon = f"and request_name='{scope}'"
-    error_query = f"select time, count(status) from {lg_type}_{project_id}..{test_name}_{aggregation} " \
-                  f"where time>='{start_time}' and time<='{end_time}' and sampler_type='{sampler}' and" \
-                  f" build_id='{build_id}' and status='KO' {scope_addon} group by time(1s)"
-    results = {"errors": {}}
-    for _ in timestamps:
-        results['errors'][_] = None
-    res = get_client(project_id).query(error_query)[f"{test_name}_{aggregation}"]
-    _tmp = []
-    if 'm' in aggregation:
-        aggregation = f"{str(int(aggregation.replace('m', ''))*60)}s"
-    for _ in res:
-        _tmp.append(_['count'])
-        if (len(_tmp) % int(aggregation.replace('s', ''))) == 0:
-            results['errors'][_['time']] = sum(_tmp)
-            _tmp = []
+        conditions.append(f"request_name='{scope}'")
+    error_query = bucketed("count(status)", f"{lg_type}_{project_id}..{test_name}_{aggregation}", conditions,
+                           aggregation, fill=0)
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               error_query, timestamps, users)
+    errors = Series.from_points(res[f"{test_name}_{aggregation}"], 'count')
+    results = {"errors": errors.align(timestamps)}
     return timestamps, results, users
 
 
 def get_hits(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
              timestamps=None, users=None, scope=None, status='all'):
     project_id = get_project_id(build_id)
-    if not (timestamps and users):
-        timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
-    scope_addon = ""
-    status_addon = ""
+    conditions = [time_range(start_time, end_time), f"sampler_type='{sampler}'", f"build_id='{build_id}'"]
     if scope and scope != 'All':
-        scope_addon = f"and request_name='{scope}'"
+        conditions.append(f"request_name='{scope}'")
     if status != 'all':
-        status_addon = f" and status='{status.upper()}'"
-    hits_query = f"select hit from {lg_type}_{project_id}..{test_name} where " \
-                 f"time>='{start_time}' and time<='{end_time}'{status_addon} and sampler_type='{sampler}' and" \
-                 f" build_id='{build_id}' {scope_addon}"
-    results = {"hits": {}}
-    res = get_client(project_id).query(hits_query)[test_name]
-    for _ in res:
-        hit_time = datetime.fromtimestamp(float(_["hit"]), tz=timezone.utc)
-        if hit_time.strftime("%Y-%m-%dT%H:%M:%SZ") in results['hits']:
-            results['hits'][hit_time.strftime("%Y-%m-%dT%H:%M:%SZ")] += 1
-        else:
-            results['hits'][hit_time.strftime("%Y-%m-%dT%H:%M:%SZ")] = 1
-    # aggregation of hits
-    _tmp = []
-    if 'm' in aggregation:
-        aggregation = f"{str(int(aggregation.replace('m', ''))*60)}s"
-    _ts = None
-    for _ in results['hits']:
-        if len(_tmp) == 0:
-            _ts = _
-        _tmp.append(results['hits'][_])
-        results['hits'][_] = None
-        if (len(_tmp) % int(aggregation.replace('s', ''))) == 0:
-            results['hits'][_ts] = float(sum(_tmp))
-            _tmp = []
-            _ts = None
+        conditions.append(f"status='{status.upper()}'")
+    hits_query = bucketed("count(hit)", f"{lg_type}_{project_id}..{test_name}", conditions, aggregation, fill=0)
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               hits_query, timestamps, users)
+    hits = Series.from_points(res[test_name], 'count')
+    results = {"hits": hits.align(timestamps)}
     return timestamps, results, users
 
 
 def get_hits_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler, status='all'):
-    timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
     results = {"throughput": {}}
-    _, responses, _ = get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
-                              timestamps, users, status=status)
+    timestamps, responses, users = get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
+                                           status=status)
     results['throughput'] = responses['responses']
     # _, hits, _ = get_hits(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
     #                       timestamps, users, status=status)
@@ -377,7 +402,6 @@ def get_hits_tps(build_id, test_name, lg_type, start_time, end_time, aggregation
 
 def average_responses(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler, status='all'):
     project_id = get_project_id(build_id)
-    timestamps, users = get_backend_users(build_id, lg_type, start_time, end_time, aggregation)
     status_addon = ""
     if status != 'all':
         status_addon = f" and status='{status.upper()}'"
@@ -385,7 +409,9 @@ def average_responses(build_id, test_name, lg_type, start_time, end_time, aggreg
                       f"where time>='{start_time}' " \
                       f"and time<='{end_time}' and sampler_type='{sampler}'{status_addon} and " \
                       f"build_id='{build_id}' group by time({aggregation})"
-    res = get_client(project_id).query(responses_query)[f"{test_name}_{aggregation}"]
+    timestamps, users, res = _query_with_users(build_id, project_id, lg_type, start_time, end_time, aggregation,
+                                               responses_query)
+    res = res[f"{test_name}_{aggregation}"]
     results = {"responses": {}}
     for _ in timestamps:
         results['responses'][_] = None
@@ -424,12 +450,9 @@ def delete_test_data(build_id, test_name, lg_type):
     project_id = get_project_id(build_id)
     query_one = f"DELETE from {test_name} where build_id='{build_id}'"
     query_two = f"DELETE from api_comparison where build_id='{build_id}'"
-    client = get_client(project_id, f"{lg_type}_{project_id}")
-    client.query(query_one)
-    client.close()
-    client = get_client(project_id, f'comparison_{project_id}')
-    client.query(query_two)
-    client.close()
+    get_client(project_id, f"{lg_type}_{project_id}").query(query_one)
+    get_client(project_id, f'comparison_{project_id}').query(query_two)
+    purge_results(build_id)
     return True
 
 
@@ -440,4 +463,11 @@ def get_aggregated_test_results(test, build_id):
 
 
 def get_project_id(build_id):
-    return APIReport.query.filter_by(build_id=build_id).first().to_json()["project_id"]
+    project_id = _build_projects.get(build_id, _NOT_CACHED)
+    if project_id is _NOT_CACHED:
+        row = APIReport.query.with_entities(APIReport.project_id).filter_by(build_id=build_id).first()
+        project_id = row.project_id if row else None
+        _build_projects.set(build_id, project_id, ttl=None if row else BUILD_PROJECT_NEGATIVE_TTL)
+    if project_id is None:
+        raise AttributeError(f"Report for build {build_id} is not found")
+    return project_id
@@ -12,33 +12,88 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from requests import get
-from galloper.constants import LOKI_HOST
+from galloper.utils.http import get_session
+from galloper.constants import LOKI_HOST, LOKI_PAGE_SIZE, LOKI_MAX_ISSUES
 
+NS = 1000000000
 
-def get_results(test, int_start_time, int_end_time):
+
+def _log_query(test):
+    return '{filename="/tmp/' + test + '.log"}'
+
+
+def iter_lines(query, int_start_time, int_end_time, page_size=LOKI_PAGE_SIZE):
+    """
+    Log lines from the newest to the oldest, paged through query_range. Every next page ends at the oldest
+    entry of the previous one, entries of that very nanosecond which were already yielded are skipped.
+    """
     url = f"{LOKI_HOST}/loki/api/v1/query_range"
-    data = {
-        "direction": "BACKWARD",
-        "limit": 5000,
-        "query": '{filename="/tmp/' + test + '.log"}',
-        "start": int_start_time,
-        "end": int_end_time
-    }
-    results = get(url, params=data, headers={"Content-Type": "application/json"}).json()
+    start = int(int_start_time) * NS
+    end = int(int_end_time) * NS
+    boundary, seen = None, set()
+    while True:
+        data = {
+            "direction": "BACKWARD",
+            "limit": page_size,
+            "query": query,
+            "start": start,
+            "end": end
+        }
+        results = get_session().get(url, params=data, headers={"Content-Type": "application/json"}).json()
+        entries = [(int(ts), line, str(result.get("stream")))
+                   for result in results["data"]["result"] for ts, line in result["values"]]
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        for ts, line, stream in entries:
+            if ts == boundary and (stream, line) in seen:
+                continue
+            yield line
+        if len(entries) < page_size:
+            return
+        oldest = entries[-1][0]
+        if entries[0][0] == oldest:
+            # whole page is a single nanosecond, it is stepped over rather than paged through forever
+            end, boundary, seen = oldest, None, set()
+            continue
+        if oldest != boundary:
+            boundary, seen = oldest, set()
+        seen.update((stream, line) for ts, line, stream in entries if ts == oldest)
+        # query_range end is exclusive, so the next page starts with the boundary nanosecond
+        end = oldest + 1
+
+
+def parse_line(line):
+    """ 'Error key: abc\\tRequest name: xyz' -> {"Error key": "abc", "Request name": "xyz"} """
+    issue = {}
+    for field in line.strip().split("\t"):
+        key, sep, value = field.partition(":")
+        if sep:
+            issue[key] = value.strip()
+    return issue
+
+
+def get_results(test, int_start_time, int_end_time):
+    """ Issues by their error key with the number of their occurrences, details are taken from the latest one """
     issues = {}
-    for result in results["data"]["result"]:
-        for value in result['values']:
-            _values = value[1].strip().split("\t")
-            _issue = {"count": 1}
-            _issue_key = ''
-            for _ in _values:
-                if ":" in _:
-                    key, value = _[:_.index(':')], _[_.index(':')+1:].strip()
-                    if key == 'Error key' and value in issues:
-                        issues[value]["count"] += 1
-                        continue
-                    _issue[key] = value
-            if 'Error key' in _issue and _issue['Error key'] not in issues.keys():
-                issues[_issue['Error key']] = _issue
+    for line in iter_lines(_log_query(test), int_start_time, int_end_time):
+        issue = parse_line(line)
+        key = issue.get("Error key")
+        if key is None:
+            continue
+        if key in issues:
+            issues[key]["count"] += 1
+        elif len(issues) < LOKI_MAX_ISSUES:
+            issue["count"] = 1
+            issues[key] = issue
     return issues
+
+
+def count_results(test, int_start_time, int_end_time):
+    """ Number of occurrences of every error key, counted by Loki itself """
+    url = f"{LOKI_HOST}/loki/api/v1/query"
+    duration = max(int(int_end_time) - int(int_start_time), 1)
+    query = f'sum by (error_key) (count_over_time({_log_query(test)} ' \
+            f'| regexp "Error key:\\\\s*(?P<error_key>[^\\\\t]*)" [{duration}s]))'
+    data = {"query": query, "time": int(int_end_time) * NS}
+    results = get_session().get(url, params=data, headers={"Content-Type": "application/json"}).json()
+    return {result["metric"].get("error_key", ""): int(float(result["value"][1]))
+            for result in results["data"]["result"]}
@@ -0,0 +1,38 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from functools import lru_cache
+
+from galloper.constants import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT, REDIS_USER
+
+try:
+    from redis import Redis  # pylint: disable=E0401
+    from redis.exceptions import RedisError  # pylint: disable=E0401
+except ImportError:
+    Redis = None
+
+    class RedisError(Exception):
+        pass
+
+
+@lru_cache()
+def get_redis(db=REDIS_DB, socket_timeout=None):
+    """
+    Shared Redis client of the db, None if redis package is not installed.
+    No socket_timeout by default, pub/sub listeners block on reads for as long as there are no messages.
+    """
+    if Redis is None:
+        return None
+    return Redis.from_url(f"redis://{REDIS_USER}:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{db}",
+                          socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
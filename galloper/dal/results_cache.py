@@ -0,0 +1,172 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from functools import wraps
+from hashlib import sha1
+from json import dumps, loads
+from os import makedirs, path, remove, replace, rmdir, scandir
+from shutil import rmtree
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from galloper.constants import (RESULTS_CACHE_DIR, RESULTS_CACHE_TTL, RESULTS_CACHE_MAX_SIZE,
+                                RESULTS_CACHE_PRUNE_INTERVAL, RESULTS_CACHE_REDIS_DB, RESULTS_CACHE_REDIS_TIMEOUT)
+from galloper.dal.redis_client import get_redis, RedisError
+from galloper.database.models.api_reports import APIReport
+
+CACHE_KEY_ARGS = ("metric", "scope", "sampler", "status", "aggregator", "low_value", "high_value",
+                  "start_time", "end_time", "format")
+_pruned_at = 0
+_prune_lock = Lock()
+
+
+def _digest(value):
+    return sha1(value.encode("utf-8")).hexdigest()
+
+
+def _redis():
+    return get_redis(RESULTS_CACHE_REDIS_DB, RESULTS_CACHE_REDIS_TIMEOUT)
+
+
+def _build_dir(build_id):
+    return path.join(RESULTS_CACHE_DIR, _digest(build_id))
+
+
+def results_key(name, params):
+    """ Content address of a result: hash of the producing function and all its parameters """
+    return _digest(dumps([name, params], sort_keys=True, default=str))
+
+
+def get_cached_results(build_id, key):
+    redis = _redis()
+    if redis is not None:
+        try:
+            value = redis.get(f"results:{build_id}:{key}")
+            return loads(value) if value is not None else None
+        except RedisError:
+            pass
+    file_path = path.join(_build_dir(build_id), key)
+    try:
+        if path.getmtime(file_path) + RESULTS_CACHE_TTL < time():
+            return None
+        with open(file_path, "r") as f:
+            return loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def set_cached_results(build_id, key, value):
+    data = dumps(value)
+    redis = _redis()
+    if redis is not None:
+        try:
+            pipe = redis.pipeline()
+            pipe.set(f"results:{build_id}:{key}", data, ex=RESULTS_CACHE_TTL)
+            pipe.sadd(f"results:{build_id}", key)
+            pipe.expire(f"results:{build_id}", RESULTS_CACHE_TTL)
+            pipe.execute()
+            return
+        except RedisError:
+            pass
+    build_dir = _build_dir(build_id)
+    try:
+        makedirs(build_dir, exist_ok=True)
+        tmp_path = path.join(build_dir, f".{uuid4()}")
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        replace(tmp_path, path.join(build_dir, key))
+    except OSError:
+        return
+    _maybe_prune()
+
+
+def _cached_files():
+    """ (mtime, size, path) of every file in RESULTS_CACHE_DIR along with the build directories """
+    files = []
+    try:
+        build_dirs = [entry.path for entry in scandir(RESULTS_CACHE_DIR) if entry.is_dir()]
+    except OSError:
+        return files, []
+    for build_dir in build_dirs:
+        try:
+            for entry in scandir(build_dir):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            # removed by a concurrent purge
+            continue
+    return files, build_dirs
+
+
+def prune_results():
+    """ Drop expired results from RESULTS_CACHE_DIR and the oldest ones while it is above RESULTS_CACHE_MAX_SIZE """
+    files, build_dirs = _cached_files()
+    expired = time() - RESULTS_CACHE_TTL
+    total = sum(size for _, size, _ in files)
+    for mtime, size, file_path in sorted(files):
+        if mtime >= expired and total <= RESULTS_CACHE_MAX_SIZE:
+            break
+        try:
+            remove(file_path)
+        except OSError:
+            pass
+        total -= size
+    for build_dir in build_dirs:
+        try:
+            rmdir(build_dir)
+        except OSError:
+            # not empty
+            pass
+
+
+def _maybe_prune():
+    global _pruned_at  # pylint: disable=W0603
+    with _prune_lock:
+        if _pruned_at + RESULTS_CACHE_PRUNE_INTERVAL > time():
+            return
+        _pruned_at = time()
+    prune_results()
+
+
+def purge_results(build_id):
+    """ Drop all cached results of the build """
+    redis = _redis()
+    if redis is not None:
+        try:
+            keys = [f"results:{build_id}:{key.decode('utf-8')}" for key in redis.smembers(f"results:{build_id}")]
+            redis.delete(f"results:{build_id}", *keys)
+        except RedisError:
+            pass
+    rmtree(_build_dir(build_id), ignore_errors=True)
+
+
+def is_finished(build_id):
+    report = APIReport.query.with_entities(APIReport.end_time).filter_by(build_id=build_id).first()
+    return bool(report and report.end_time)
+
+
+def cache_finished_results(func):
+    """ Cache results of chart function func(args) for builds which are finished, results of those never change """
+    @wraps(func)
+    def decorated_function(args):
+        if not args.get("end_time") or not is_finished(args["build_id"]):
+            return func(args)
+        key = results_key(func.__name__, {name: args.get(name) for name in CACHE_KEY_ARGS})
+        results = get_cached_results(args["build_id"], key)
+        if results is None:
+            results = func(args)
+            set_cached_results(args["build_id"], key, results)
+        return results
+    return decorated_function
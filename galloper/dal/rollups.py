@@ -0,0 +1,206 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Per build aggregates materialized into Postgres when the test is finished """
+
+from itertools import combinations
+from traceback import format_exc
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from galloper.constants import ROLLUP_AGGREGATIONS, ROLLUP_BATCH_SIZE
+from galloper.dal import influx_results
+from galloper.dal.influx_results import query_batch
+from galloper.database.db_manager import db_session
+from galloper.database.models.api_report_rollup import APIReportRollup
+from galloper.utils.concurrency import fan_out
+
+GROUP_TAGS = ("sampler_type", "request_name", "status")
+# influx field -> rollup column, all of them are rolled up as 95th percentile
+PERCENTILES = {"min": "_min", "max": "_max", "median": "median", "pct95": "pct95", "pct99": "pct99"}
+# aggregation of the row every build gets once rollups were attempted, so builds without data are not retried
+BUILT_MARKER = "built"
+
+
+def _group_by(tags, interval=None):
+    group_by = list(tags) + ([f"time({interval})"] if interval else [])
+    return f" group by {', '.join(group_by)}" if group_by else ""
+
+
+def _rollup_queries(source, build_id, tags, aggregation):
+    percentiles = ", ".join(f"percentile(\"{field}\", 95) as \"{field}\"" for field in PERCENTILES)
+    where = f" where build_id='{build_id}'"
+    return [
+        f"select sum(total) as total, {percentiles} from {source}{where}{_group_by(tags)}",
+        f"select sum(total) as errors from {source}{where} and status='KO'{_group_by(tags)}",
+        f"select mean(rt) as throughput from (select sum(total) as rt from {source}{where}"
+        f"{_group_by(tags, aggregation)}){_group_by(tags)}"
+    ]
+
+
+def _points(result):
+    """ First point of every series keyed by (sampler, request_name, status) """
+    points = {}
+    for (_, tags), series in result.items():
+        tags = tags or {}
+        point = next(iter(series), None)
+        if point:
+            points[(tags.get("sampler_type", ""), tags.get("request_name", "All"), tags.get("status", "all"))] = point
+    return points
+
+
+def build_rollups(report):
+    """
+    Materialize aggregates of every sampler, request and status combination, a few Influx requests per aggregation.
+    A failed request only leaves its combinations out, those are served from Influx then.
+    Raises if every request failed.
+    """
+    project_id = report.project_id
+    tag_sets = [tags for size in range(len(GROUP_TAGS) + 1) for tags in combinations(GROUP_TAGS, size)]
+    rollups = []
+    seen = set()
+    error = None
+    for aggregation in ROLLUP_AGGREGATIONS:
+        source = f"{report.lg_type}_{project_id}..{report.name}_{aggregation}"
+        for i in range(0, len(tag_sets), ROLLUP_BATCH_SIZE):
+            batch = tag_sets[i:i + ROLLUP_BATCH_SIZE]
+            queries = [query for tags in batch for query in _rollup_queries(source, report.build_id, tags, aggregation)]
+            try:
+                results = iter(query_batch(project_id, queries))
+            except Exception as e:  # pylint: disable=W0703
+                current_app.logger.warning(f"Rollups of {report.build_id} by {batch} failed: {e}")
+                error = e
+                continue
+            for _ in batch:
+                stats, errors, throughput = _points(next(results)), _points(next(results)), _points(next(results))
+                for key, point in stats.items():
+                    sampler, request_name, status = key
+                    if (aggregation, key) in seen:
+                        # a request literally named 'All' or alike, the first, wider group keeps the key
+                        continue
+                    seen.add((aggregation, key))
+                    rollups.append(APIReportRollup(
+                        project_id=project_id, report_id=report.id, build_id=report.build_id,
+                        aggregation=aggregation, sampler=sampler, request_name=request_name, status=status,
+                        total=point["total"], errors=errors.get(key, {}).get("errors") or 0,
+                        throughput=throughput.get(key, {}).get("throughput"),
+                        **{column: point[field] for field, column in PERCENTILES.items()}
+                    ))
+    if error is not None and not rollups:
+        raise error
+    rollups.append(_marker(report))
+    delete_rollups(report.build_id, commit=False)
+    db_session.add_all(rollups)
+    _commit_rollups(report)
+
+
+def _commit_rollups(report):
+    try:
+        db_session.commit()
+    except IntegrityError:
+        # rollups of the build were written meanwhile by a concurrent backfill or finished test
+        db_session.rollback()
+        current_app.logger.info(f"Rollups of {report.build_id} are already there")
+
+
+def delete_rollups(build_id, commit=True):
+    APIReportRollup.query.filter_by(build_id=build_id).delete(synchronize_session=False)
+    if commit:
+        db_session.commit()
+
+
+def _key(build_id, aggregation, sampler, request_name, status):
+    return build_id, aggregation, sampler or "", request_name, status if status == 'all' else status.upper()
+
+
+def _get_rollup(build_id, sampler, scope, status, aggregation, rollups=None):
+    key = _key(build_id, aggregation, sampler, scope, status)
+    if rollups is not None:
+        return rollups.get(key)
+    return APIReportRollup.query.filter_by(
+        **dict(zip(("build_id", "aggregation", "sampler", "request_name", "status"), key))
+    ).first()
+
+
+def _marker(report):
+    return APIReportRollup(project_id=report.project_id, report_id=report.id, build_id=report.build_id,
+                           aggregation=BUILT_MARKER, sampler="", request_name="", status="")
+
+
+def _backfill(report):
+    try:
+        build_rollups(report)
+    except Exception:  # pylint: disable=W0703
+        # build stays without rollups, its numbers are taken from Influx
+        current_app.logger.error(f"Rollups of {report.build_id} failed: {format_exc()}")
+        db_session.rollback()
+        db_session.add(_marker(report))
+        _commit_rollups(report)
+
+
+def load_rollups(reports, request_names=None):
+    """
+    Rollups of all the reports fetched with one query, keyed for lookups by get_*_per_test.
+    Finished reports which were never rolled up are backfilled concurrently, once: failed builds get the marker too.
+    """
+    def fetch(build_ids):
+        query = APIReportRollup.query.filter(APIReportRollup.build_id.in_(build_ids))
+        if request_names:
+            query = query.filter(or_(APIReportRollup.request_name.in_(request_names),
+                                     APIReportRollup.aggregation == BUILT_MARKER))
+        return query.all()
+
+    rows = fetch([report.build_id for report in reports])
+    present = {row.build_id for row in rows}
+    missing = [report for report in reports if report.end_time and report.build_id not in present]
+    if missing:
+        fan_out(_backfill, missing)
+        rows.extend(fetch([report.build_id for report in missing]))
+    return {_key(row.build_id, row.aggregation, row.sampler, row.request_name, row.status): row
+            for row in rows if row.aggregation != BUILT_MARKER}
+
+
+def get_response_time_per_test(build_id, test_name, lg_type, sampler, scope, aggr, status='all', aggregator="30s",
+                               rollups=None):
+    """
+    Same as influx_results.get_response_time_per_test, served from rollups once they are there.
+    Rollups are looked up in the rollups dict made by load_rollups if it is given.
+    """
+    rollup = None
+    if scope and aggregator in ROLLUP_AGGREGATIONS:
+        # errors are counted over every status, like in Influx query
+        rollup = _get_rollup(build_id, sampler, scope, 'all' if 'errors' in aggr else status, aggregator, rollups)
+    if rollup is None:
+        return influx_results.get_response_time_per_test(build_id, test_name, lg_type, sampler, scope, aggr,
+                                                         status, aggregator)
+    if aggr in PERCENTILES:
+        value = getattr(rollup, PERCENTILES[aggr])
+    elif 'errors' in aggr:
+        value = rollup.errors
+    else:
+        value = rollup.total
+    return round(value, 2)
+
+
+def get_throughput_per_test(build_id, test_name, lg_type, sampler, scope, aggregator, status='all', rollups=None):
+    """ Same as influx_results.get_throughput_per_test, served from rollups once they are there """
+    rollup = None
+    if scope and aggregator in ROLLUP_AGGREGATIONS:
+        rollup = _get_rollup(build_id, sampler, scope, status, aggregator, rollups)
+    if rollup is None or rollup.throughput is None:
+        return influx_results.get_throughput_per_test(build_id, test_name, lg_type, sampler, scope, aggregator,
+                                                      status)
+    return round(rollup.throughput, 2)
@@ -17,16 +17,32 @@
 
 """ Vault tools """
 
+from copy import deepcopy
+from json import dumps, loads
+from os import getpid
+from socket import gethostname
+from threading import Lock, Thread
+from time import sleep
 from jinja2 import Template
 
 import hvac  # pylint: disable=E0401
-import requests  # pylint: disable=E0401
 from requests.exceptions import ConnectionError
 import galloper.constants as consts
 from galloper.database.models.vault import Vault
 from galloper.database.models.project import Project
+from galloper.dal.redis_client import get_redis, RedisError
+from galloper.utils.cache import TTLCache
+from galloper.utils.http import get_session
 from flask import current_app
 
+# project_id -> AppRole authenticated client
+_clients_cache = TTLCache(maxsize=consts.VAULT_CACHE_SIZE, ttl=consts.VAULT_TOKEN_TTL)
+# (project_id, mount_point) -> secrets
+_secrets_cache = TTLCache(maxsize=consts.VAULT_CACHE_SIZE, ttl=consts.VAULT_CACHE_TTL)
+_invalidation_listeners = []
+_subscriber_lock = Lock()
+_subscriber_pid = None
+
 
 def init_vault():
     """ Initialize Vault """
@@ -71,7 +87,7 @@ def unseal(client):
 
 
 def create_client():
-    client = hvac.Client(url=consts.VAULT_URL)
+    client = hvac.Client(url=consts.VAULT_URL, session=get_session())
     unseal(client)
     return client
 
@@ -90,6 +106,9 @@ def get_root_client():
 
 def get_project_client(project_id):
     """ Get "project" Vault client instance """
+    client = _clients_cache.get(int(project_id))
+    if client:
+        return client
     # Get Vault client
     client = create_client()
     # Get project from DB
@@ -99,10 +118,108 @@ def get_project_client(project_id):
         project.secrets_json["vault_auth_role_id"], project.secrets_json["vault_auth_secret_id"],
         mount_point="carrier-approle",
     )
+    _clients_cache.set(int(project_id), client)
     # Done
     return client
 
 
+def on_project_secrets_change(callback):
+    """ Register callback(project_id) to be called when project secrets are changed or invalidated """
+    _invalidation_listeners.append(callback)
+
+
+def invalidate_project_cache(project_id, publish=True):
+    """ Drop cached secrets and token of the project, notify other workers if needed """
+    project_id = int(project_id)
+    _secrets_cache.invalidate(lambda key: key[0] == project_id)
+    _clients_cache.pop(project_id)
+    _notify_secrets_change(project_id, publish)
+
+
+def _notify_secrets_change(project_id, publish):
+    for callback in _invalidation_listeners:
+        callback(project_id)
+    if publish:
+        _publish_invalidation(project_id)
+
+
+def _worker_id():
+    return f"{gethostname()}:{getpid()}"
+
+
+def _publish_invalidation(project_id):
+    client = get_redis()
+    if not consts.VAULT_CACHE_PUBSUB or client is None:
+        return
+    try:
+        client.publish(consts.VAULT_CACHE_CHANNEL, dumps({"worker": _worker_id(), "project_id": project_id}))
+    except RedisError:
+        # other workers will pick up the change when their cache entries expire
+        pass
+
+
+def _listen_invalidations():
+    client = get_redis()
+    if client is None:
+        return
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(consts.VAULT_CACHE_CHANNEL)
+            for message in pubsub.listen():
+                data = loads(message["data"])
+                if data["worker"] != _worker_id():
+                    invalidate_project_cache(data["project_id"], publish=False)
+        except RedisError:
+            sleep(5)
+
+
+def _start_invalidation_listener():
+    global _subscriber_pid  # pylint: disable=W0603
+    if not consts.VAULT_CACHE_PUBSUB or _subscriber_pid == getpid():
+        return
+    with _subscriber_lock:
+        # listener thread does not survive fork, so it is started once per process
+        if _subscriber_pid != getpid():
+            _subscriber_pid = getpid()
+            Thread(target=_listen_invalidations, daemon=True).start()
+
+
+def _read_project_kv(project_id, mount_point):
+    """ Read project KV through the cache, returns a copy which is safe to modify """
+    _start_invalidation_listener()
+    key = (int(project_id), mount_point)
+    secrets = _secrets_cache.get(key)
+    if secrets is None:
+        try:
+            client = get_project_client(project_id)
+            secrets = client.secrets.kv.v2.read_secret_version(
+                path="project-secrets",
+                mount_point=mount_point,
+            ).get("data", dict()).get("data", dict())
+        except hvac.exceptions.Forbidden:
+            # Cached token could be expired or revoked, retry with a fresh one
+            _clients_cache.pop(int(project_id))
+            client = get_project_client(project_id)
+            secrets = client.secrets.kv.v2.read_secret_version(
+                path="project-secrets",
+                mount_point=mount_point,
+            ).get("data", dict()).get("data", dict())
+        _secrets_cache.set(key, secrets)
+    return deepcopy(secrets)
+
+
+def _write_project_kv(project_id, mount_point, secrets):
+    client = get_project_client(project_id)
+    client.secrets.kv.v2.create_or_update_secret(
+        path="project-secrets",
+        mount_point=mount_point,
+        secret=secrets,
+    )
+    _secrets_cache.set((int(project_id), mount_point), deepcopy(secrets))
+    _notify_secrets_change(int(project_id), publish=True)
+
+
 def add_hidden_kv(project_id, client=None):
     # Create hidden secrets KV
     if not client:
@@ -166,16 +283,16 @@ def initialize_project_space(project_id):
     add_hidden_kv(project_id, client)
     # Create AppRole
     approle_name = f"role-for-{project_id}"
-    requests.post(
+    get_session().post(
         f"{consts.VAULT_URL}/v1/auth/carrier-approle/role/{approle_name}",
         headers={"X-Vault-Token": client.token},
         json={"policies": [f"policy-for-{project_id}"]}
     )
-    approle_role_id = requests.get(
+    approle_role_id = get_session().get(
         f"{consts.VAULT_URL}/v1/auth/carrier-approle/role/{approle_name}/role-id",
         headers={"X-Vault-Token": client.token},
     ).json()["data"]["role_id"]
-    approle_secret_id = requests.post(
+    approle_secret_id = get_session().post(
         f"{consts.VAULT_URL}/v1/auth/carrier-approle/role/{approle_name}/secret-id",
         headers={"X-Vault-Token": client.token},
     ).json()["data"]["secret_id"]
@@ -190,7 +307,7 @@ def remove_project_space(project_id):
     """ Remove project-specific data from Vault """
     client = get_root_client()
     # Remove AppRole
-    requests.delete(
+    get_session().delete(
         f"{consts.VAULT_URL}/v1/auth/carrier-approle/role/role-for-{project_id}",
         headers={"X-Vault-Token": client.token},
     )
@@ -206,27 +323,18 @@ def remove_project_space(project_id):
     client.sys.delete_policy(
         name=f"policy-for-{project_id}",
     )
+    invalidate_project_cache(project_id)
 
 
 def set_project_secrets(project_id, secrets):
     """ Set project secrets """
-    client = get_project_client(project_id)
-    client.secrets.kv.v2.create_or_update_secret(
-        path="project-secrets",
-        mount_point=f"kv-for-{project_id}",
-        secret=secrets,
-    )
+    _write_project_kv(project_id, f"kv-for-{project_id}", secrets)
 
 
 def set_project_hidden_secrets(project_id, secrets):
     """ Set project hidden secrets """
     try:
-        client = get_project_client(project_id)
-        client.secrets.kv.v2.create_or_update_secret(
-            path="project-secrets",
-            mount_point=f"kv-for-hidden-{project_id}",
-            secret=secrets,
-        )
+        _write_project_kv(project_id, f"kv-for-hidden-{project_id}", secrets)
     except (hvac.exceptions.Forbidden, hvac.exceptions.InvalidPath):
         current_app.logger.error("Exception Forbidden in set_project_hidden_secret")
         set_hidden_kv_permissions(project_id)
@@ -235,21 +343,13 @@ def set_project_hidden_secrets(project_id, secrets):
 
 def get_project_secrets(project_id):
     """ Get project secrets """
-    client = get_project_client(project_id)
-    return client.secrets.kv.v2.read_secret_version(
-        path="project-secrets",
-        mount_point=f"kv-for-{project_id}",
-    ).get("data", dict()).get("data", dict())
+    return _read_project_kv(project_id, f"kv-for-{project_id}")
 
 
 def get_project_hidden_secrets(project_id):
     """ Get project hidden secrets """
-    client = get_project_client(project_id)
     try:
-        return client.secrets.kv.v2.read_secret_version(
-            path="project-secrets",
-            mount_point=f"kv-for-hidden-{project_id}",
-        ).get("data", dict()).get("data", dict())
+        return _read_project_kv(project_id, f"kv-for-hidden-{project_id}")
     except (hvac.exceptions.Forbidden, hvac.exceptions.InvalidPath):
         current_app.logger.error("Exception Forbidden in get_project_hidden_secret")
         set_hidden_kv_permissions(project_id)
@@ -1,11 +1,21 @@
-from datetime import datetime, timezone
+from datetime import datetime
+from functools import partial
 from galloper.database.models.api_reports import APIReport
 from galloper.dal.influx_results import (get_backend_requests, get_hits_tps, average_responses, get_build_data, get_tps,
-                                         get_hits, get_errors, get_response_codes, get_backend_users,
-                                         get_throughput_per_test, get_response_time_per_test)
-from galloper.dal.loki import get_results
+                                         get_hits, get_errors, get_response_codes, get_backend_users)
+from galloper.dal.rollups import get_throughput_per_test, get_response_time_per_test
+from galloper.dal.loki import get_results, count_results
+from galloper.dal.results_cache import cache_finished_results, results_key
 from galloper.data_utils.report_utils import calculate_proper_timeframe, chart_data, create_dataset, comparison_data
-from galloper.constants import str_to_timestamp
+from galloper.data_utils.series import aggregation_to_seconds, epochs_to_labels, overlap_buckets
+from galloper.constants import str_to_timestamp, LIVE_CACHE_SIZE, LIVE_CACHE_TTL
+from galloper.utils.cache import TTLCache
+from galloper.utils.concurrency import fan_out
+
+# series key -> data delivered so far for running tests
+_live_series = TTLCache(maxsize=LIVE_CACHE_SIZE, ttl=LIVE_CACHE_TTL)
+LIVE_KEY_ARGS = ("build_id", "metric", "scope", "sampler", "status", "aggregator", "start_time")
+_NO_DATA = object()
 
 
 def _timeframe(args, time_as_ts=False):
@@ -19,12 +29,61 @@ def _timeframe(args, time_as_ts=False):
                                       time_as_ts=time_as_ts)
 
 
+def _is_live(args):
+    return args.get('cursor') is not None and not args['end_time'] and not args.get('low_value')
+
+
+def _live_query(args, name, fetch, render):
+    """
+    Live mode for running tests. Series delivered so far are kept in memory and only the tail, the last
+    LIVE_OVERLAP seconds of buckets which could still get late points, is queried on refresh. With non-empty
+    cursor only buckets starting from the cursor or from the re-queried tail, whichever is earlier, are
+    returned, so the client replaces its points from the first returned one on. The new cursor is returned
+    along with the data.
+    """
+    start_time, end_time, aggregation = _timeframe(args)
+    key = results_key(name, {arg: args.get(arg) for arg in LIVE_KEY_ARGS})
+    prefix = _live_series.get(key)
+    if not (prefix and prefix["aggregation"] == aggregation and prefix["timestamps"]):
+        prefix = {"aggregation": aggregation, "timestamps": [], "users": {"users": {}}, "results": {}}
+    overlap = overlap_buckets(aggregation_to_seconds(aggregation))
+    tail_start = prefix["timestamps"][-overlap] if len(prefix["timestamps"]) >= overlap else start_time
+    timestamps, users, results = fetch(tail_start, end_time, aggregation)
+    # cached prefix could be shared with concurrent requests, so it is copied rather than updated in place
+    prefix = {
+        "aggregation": aggregation,
+        "timestamps": [ts for ts in prefix["timestamps"] if ts < tail_start] + timestamps,
+        "users": {"users": {**prefix["users"]["users"], **users["users"]}},
+        "results": {series: {**prefix["results"].get(series, {}), **results.get(series, {})}
+                    for series in list(prefix["results"]) + [_ for _ in results if _ not in prefix["results"]]}
+    }
+    _live_series.set(key, prefix)
+
+    cursor = args.get('cursor')
+    since = min(cursor, tail_start) if cursor else None
+    timestamps = [ts for ts in prefix["timestamps"] if ts >= since] if since else prefix["timestamps"]
+    users = {"users": {ts: prefix["users"]["users"].get(ts) for ts in timestamps}}
+    results = {series: {ts: values.get(ts) for ts in timestamps} for series, values in prefix["results"].items()}
+    data = render(timestamps, users, results)
+    data["cursor"] = timestamps[-1] if timestamps else cursor
+    return data
+
+
 def _query_only(args, query_func):
+    if _is_live(args):
+        def fetch(start_time, end_time, aggregation):
+            timeline, results, users = query_func(args['build_id'], args['test_name'], args['lg_type'],
+                                                  start_time, end_time, aggregation,
+                                                  sampler=args['sampler'], status=args["status"])
+            return timeline, users, results
+        # live data is appended on the client, so it goes as is
+        return _live_query(args, query_func.__name__, fetch,
+                           partial(chart_data, max_points=None, fmt=args.get('format')))
     start_time, end_time, aggregation = _timeframe(args)
     timeline, results, users = query_func(args['build_id'], args['test_name'], args['lg_type'],
                                           start_time, end_time, aggregation,
                                           sampler=args['sampler'], status=args["status"])
-    return chart_data(timeline, users, results)
+    return chart_data(timeline, users, results, fmt=args.get('format'))
 
 
 def get_tests_metadata(tests):
@@ -33,12 +92,8 @@ def get_tests_metadata(tests):
     responses_data = {}
     errors_data = {}
     rps_data = {}
-    labels = []
-
-    for each in tests_meta:
-        ts = datetime.fromtimestamp(str_to_timestamp(each.start_time),
-                                    tz=timezone.utc).strftime("%m-%d %H:%M:%S")
-        labels.append(ts)
+    labels = epochs_to_labels([str_to_timestamp(each.start_time) for each in tests_meta])
+    for each, ts in zip(tests_meta, labels):
         users_data[ts] = each.vusers
         responses_data[ts] = each.pct95
         errors_data[ts] = each.failures
@@ -46,18 +101,22 @@ def get_tests_metadata(tests):
     return labels, rps_data, errors_data, users_data, responses_data
 
 
+@cache_finished_results
 def requests_summary(args):
     return _query_only(args, get_backend_requests)
 
 
+@cache_finished_results
 def requests_hits(args):
     return _query_only(args, get_hits_tps)
 
 
+@cache_finished_results
 def avg_responses(args):
     return _query_only(args, average_responses)
 
 
+@cache_finished_results
 def summary_table(args):
     start_time, end_time, aggregation = _timeframe(args)
     return get_build_data(args['build_id'], args['test_name'], args['lg_type'], start_time, end_time, args['sampler'])
@@ -68,13 +127,18 @@ def get_issues(args):
     return list(get_results(args['test_name'], start_time, end_time).values())
 
 
+def get_issues_count(args):
+    start_time, end_time, aggregation = _timeframe(args, time_as_ts=True)
+    return count_results(args['test_name'], start_time, end_time)
+
+
 def calculate_analytics_dataset(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
-                                scope, metric, status):
+                                scope, metric, status, timestamps=None, users=None):
     data = None
     axe = 'count'
     if metric == "Throughput":
         timestamps, data, _ = get_tps(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
-                                      scope=scope, status=status)
+                                      timestamps, users, scope=scope, status=status)
         data = data['responses']
     # elif metric == "Hits":
     #     timestamps, data, _ = get_hits(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
@@ -82,51 +146,70 @@ def calculate_analytics_dataset(build_id, test_name, lg_type, start_time, end_ti
     #     data = data['hits']
     elif metric == "Errors":
         timestamps, data, _ = get_errors(build_id, test_name, lg_type, start_time, end_time, aggregation, sampler,
-                                         scope=scope)
+                                         timestamps, users, scope=scope)
         data = data['errors']
     elif metric in ["Min", "Median", "Max", "pct90", "pct95", "pct99"]:
         timestamps, data, _ = get_backend_requests(build_id, test_name, lg_type, start_time, end_time, aggregation,
-                                                   sampler, scope=scope, aggr=metric, status=status)
+                                                   sampler, timestamps, users, scope=scope, aggr=metric, status=status)
         data = data['response']
         axe = 'time'
 
     elif "xx" in metric:
         timestamps, data, _ = get_response_codes(build_id, test_name, lg_type, start_time, end_time, aggregation,
-                                                 sampler, scope=scope, aggr=metric, status=status)
+                                                 sampler, timestamps, users, scope=scope, aggr=metric, status=status)
         data = data['rcodes']
     return data, axe
 
 
+@cache_finished_results
 def get_data_from_influx(args):
-    start_time, end_time, aggregation = _timeframe(args)
     metric = args.get('metric', '')
     scope = args.get('scope', '')
+    if _is_live(args):
+        def fetch(start_time, end_time, aggregation):
+            timestamps, users = get_backend_users(args['build_id'], args['lg_type'],
+                                                  start_time, end_time, aggregation)
+            if metric == "Users":
+                return timestamps, users, {}
+            data, _ = calculate_analytics_dataset(args['build_id'], args['test_name'], args['lg_type'],
+                                                  start_time, end_time, aggregation, args['sampler'],
+                                                  scope, metric, args["status"], timestamps, users)
+            return timestamps, users, {"data": data or {}}
+
+        def render(timestamps, users, results):
+            if metric == "Users":
+                return create_dataset(timestamps, users['users'], f"{scope}_{metric}", 'count', max_points=None,
+                                      fmt=args.get('format'))
+            axe = 'time' if metric in ["Min", "Median", "Max", "pct90", "pct95", "pct99"] else 'count'
+            return create_dataset(timestamps, results.get('data', {}), f"{scope}_{metric}", axe, max_points=None,
+                                  fmt=args.get('format'))
+        return _live_query(args, "get_data_from_influx", fetch, render)
+    start_time, end_time, aggregation = _timeframe(args)
     timestamps, users = get_backend_users(args['build_id'], args['lg_type'],
                                           start_time, end_time, aggregation)
     axe = 'count'
     if metric == "Users":
-        return create_dataset(timestamps, users['users'], f"{scope}_{metric}", axe)
+        return create_dataset(timestamps, users['users'], f"{scope}_{metric}", axe, fmt=args.get('format'))
     data, axe = calculate_analytics_dataset(args['build_id'], args['test_name'], args['lg_type'],
                                             start_time, end_time, aggregation, args['sampler'],
-                                            scope, metric, args["status"])
+                                            scope, metric, args["status"], timestamps, users)
     if data:
-        return create_dataset(timestamps, data, f"{scope}_{metric}", axe)
+        return create_dataset(timestamps, data, f"{scope}_{metric}", axe, fmt=args.get('format'))
     else:
         return {}
 
 
 def prepare_comparison_responses(args):
     tests = args['id[]']
-    tests_meta = []
+    reports = {str(each.id): each.to_json() for each in APIReport.query.filter(APIReport.id.in_(tests)).all()}
+    tests_meta = [reports[str(test_id)] for test_id in tests]
     longest_test = 0
     longest_time = 0
     sampler = args.get('sampler', "REQUEST")
-    for i in range(len(tests)):
-        data = APIReport.query.filter_by(id=tests[i]).first().to_json()
-        if data['duration'] > longest_time:
-            longest_time = data['duration']
+    for i in range(len(tests_meta)):
+        if tests_meta[i]['duration'] > longest_time:
+            longest_time = tests_meta[i]['duration']
             longest_test = i
-        tests_meta.append(data)
     start_time, end_time, aggregation = calculate_proper_timeframe(tests_meta[longest_test]['build_id'],
                                                                    tests_meta[longest_test]['name'],
                                                                    tests_meta[longest_test]['lg_type'],
@@ -142,29 +225,32 @@ def prepare_comparison_responses(args):
     status = args.get("status", 'all')
     timestamps, users = get_backend_users(tests_meta[longest_test]['build_id'],
                                           tests_meta[longest_test]['lg_type'], start_time, end_time, aggregation)
-    test_start_time = "{}_{}".format(tests_meta[longest_test]['start_time'].replace("T", " ").split(".")[0], metric)
-    data = {test_start_time: calculate_analytics_dataset(tests_meta[longest_test]['build_id'],
-                                                         tests_meta[longest_test]['name'],
-                                                         tests_meta[longest_test]['lg_type'],
-                                                         start_time, end_time, aggregation,
-                                                         sampler, scope, metric, status)}
-    for i in range(len(tests_meta)):
-        if i != longest_test:
-            test_start_time = "{}_{}".format(tests_meta[i]['start_time'].replace("T", " ").split(".")[0], metric)
-            data[test_start_time] = calculate_analytics_dataset(tests_meta[i]['build_id'], tests_meta[i]['name'],
-                                                                tests_meta[i]['lg_type'],
-                                                                tests_meta[i]['start_time'],
-                                                                tests_meta[i]['end_time'],
-                                                                aggregation, sampler, scope, metric, status)
-    return comparison_data(timeline=timestamps, data=data)
+
+    def calculate(i):
+        if i == longest_test:
+            return calculate_analytics_dataset(tests_meta[i]['build_id'], tests_meta[i]['name'],
+                                               tests_meta[i]['lg_type'], start_time, end_time, aggregation,
+                                               sampler, scope, metric, status, timestamps, users)
+        return calculate_analytics_dataset(tests_meta[i]['build_id'], tests_meta[i]['name'],
+                                           tests_meta[i]['lg_type'], tests_meta[i]['start_time'],
+                                           tests_meta[i]['end_time'], aggregation, sampler, scope, metric, status)
+
+    # longest test goes first, its timeline is the one of the chart
+    order = [longest_test] + [i for i in range(len(tests_meta)) if i != longest_test]
+    data = {}
+    for i, dataset in zip(order, fan_out(calculate, order)):
+        test_start_time = "{}_{}".format(tests_meta[i]['start_time'].replace("T", " ").split(".")[0], metric)
+        data[test_start_time] = dataset
+    return comparison_data(timeline=timestamps, data=data, fmt=args.get('format'))
 
 
 def compare_tests(args):
     labels, rps_data, errors_data, users_data, responses_data = get_tests_metadata(args['id[]'])
     return {
-        "response": chart_data(labels, {"users": users_data}, {"pct95": responses_data}, "time"),
-        "errors": chart_data(labels, {"users": users_data}, {"errors": errors_data}, "count"),
-        "rps": chart_data(labels, {"users": users_data}, {"RPS": rps_data}, "count")
+        "response": chart_data(labels, {"users": users_data}, {"pct95": responses_data}, "time",
+                               fmt=args.get('format')),
+        "errors": chart_data(labels, {"users": users_data}, {"errors": errors_data}, "count", fmt=args.get('format')),
+        "rps": chart_data(labels, {"users": users_data}, {"RPS": rps_data}, "count", fmt=args.get('format'))
     }
 
 
@@ -176,29 +262,30 @@ def create_benchmark_dataset(args):
     status = args.get("status", 'all')
     if not aggregator or aggregator == 'auto':
         aggregator = '1s'
-    tests_meta = APIReport.query.filter(APIReport.id.in_(build_ids)).order_by(APIReport.vusers.asc()).all()
-    labels = set()
-    data = {}
-    y_axis = ''
-    for _ in tests_meta:
+    tests_meta = [(each.build_id, each.name, each.lg_type, each.environment, each.vusers) for each in
+                  APIReport.query.filter(APIReport.id.in_(build_ids)).order_by(APIReport.vusers.asc()).all()]
+    if calculation == 'throughput':
+        y_axis = 'Requests per second'
+    else:
+        y_axis = 'Errors' if calculation == 'errors' else 'Response time, ms'
+
+    def calculate(test):
+        build_id, name, lg_type, _, _ = test
         try:
-            labels.add(_.vusers)
-            if _.environment not in data:
-                data[_.environment] = {}
             if calculation == 'throughput':
-                y_axis = 'Requests per second'
-                data[_.environment][str(_.vusers)] = get_throughput_per_test(
-                    _.build_id, _.name, _.lg_type, "", req, aggregator, status)
-            elif calculation != ['throughput']:
-                y_axis = 'Response time, ms'
-                if calculation == 'errors':
-                    y_axis = 'Errors'
-                data[_.environment][str(_.vusers)] = get_response_time_per_test(
-                    _.build_id, _.name, _.lg_type, "", req, calculation, status, aggregator)
-            else:
-                data[_.environment][str(_.vusers)] = None
+                return get_throughput_per_test(build_id, name, lg_type, "", req, aggregator, status)
+            return get_response_time_per_test(build_id, name, lg_type, "", req, calculation, status, aggregator)
         except IndexError:
-            pass
+            return _NO_DATA
+
+    labels = set()
+    data = {}
+    for (_, _, _, environment, vusers), value in zip(tests_meta, fan_out(calculate, tests_meta)):
+        labels.add(vusers)
+        if environment not in data:
+            data[environment] = {}
+        if value is not _NO_DATA:
+            data[environment][str(vusers)] = value
 
     labels = [""] + sorted(list(labels)) + [""]
-    return {"data": chart_data(labels, [], data, "data"), "label": y_axis}
+    return {"data": chart_data(labels, [], data, "data", fmt=args.get('format')), "label": y_axis if tests_meta else ''}
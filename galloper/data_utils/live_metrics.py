@@ -0,0 +1,205 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Shared pollers of running tests metrics, one per build and query however many viewers are there """
+
+from datetime import datetime
+from json import dumps
+from queue import Queue, Empty, Full
+from threading import BoundedSemaphore, Lock, Thread
+from time import monotonic, sleep
+
+from flask import current_app
+
+from galloper.constants import (str_to_timestamp, LIVE_POLL_INTERVAL, LIVE_KEEPALIVE_INTERVAL, LIVE_MAX_STREAMS,
+                                LIVE_STREAM_MAX_AGE, LIVE_STALE_AFTER)
+from galloper.dal.influx_results import get_tps, get_errors, get_backend_requests
+from galloper.dal.results_cache import is_finished
+from galloper.database.db_manager import db_session
+
+_pollers = {}
+_pollers_lock = Lock()
+_streams = BoundedSemaphore(LIVE_MAX_STREAMS)
+
+
+class BuildPoller(Thread):
+    def __init__(self, app, build_id, test_name, lg_type, start_time, sampler):
+        super().__init__(daemon=True)
+        self.app = app
+        self.key = (build_id, test_name, lg_type, start_time, sampler)
+        self.build_id = build_id
+        self.test_name = test_name
+        self.lg_type = lg_type
+        self.sampler = sampler
+        self.cursor = start_time
+        self.subscribers = set()
+        self.last_message = None
+
+    def poll(self):
+        end_time = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        timestamps, tps, users = get_tps(self.build_id, self.test_name, self.lg_type, self.cursor, end_time,
+                                         "1s", self.sampler)
+        if not timestamps:
+            return []
+        _, errors, _ = get_errors(self.build_id, self.test_name, self.lg_type, self.cursor, end_time,
+                                  "1s", self.sampler, timestamps, users)
+        _, rt, _ = get_backend_requests(self.build_id, self.test_name, self.lg_type, self.cursor, end_time,
+                                        "1s", self.sampler, timestamps, users, scope='All')
+        # last second could be incomplete yet, it is sent again on the next poll
+        self.cursor = timestamps[-1]
+        return [{
+            "time": ts,
+            "users": users["users"].get(ts),
+            "throughput": tps["responses"].get(ts),
+            "errors": errors["errors"].get(ts),
+            "pct95": rt["response"].get(ts)
+        } for ts in timestamps]
+
+    def is_stale(self):
+        """ Build was never finished and has no points for LIVE_STALE_AFTER seconds, e.g. its runner died """
+        return datetime.utcnow().timestamp() - str_to_timestamp(self.cursor) > LIVE_STALE_AFTER
+
+    def broadcast(self, message, subscribers=None):
+        if subscribers is None:
+            with _pollers_lock:
+                subscribers = list(self.subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(message)
+            except Full:
+                # slow reader misses points rather than slowing down everyone else
+                pass
+
+    def close(self, message):
+        """ Detach the poller so nobody subscribes to it any more and end the streams of its subscribers """
+        with _pollers_lock:
+            _pollers.pop(self.key, None)
+            subscribers = list(self.subscribers)
+        self.broadcast(message, subscribers)
+        for queue in subscribers:
+            # the end of the stream must get through even to a slow reader
+            while True:
+                try:
+                    queue.put_nowait(None)
+                    break
+                except Full:
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        pass
+
+    def run(self):
+        try:
+            while True:
+                with _pollers_lock:
+                    if not self.subscribers:
+                        _pollers.pop(self.key, None)
+                        return
+                with self.app.app_context():
+                    points = self.poll()
+                    if points:
+                        self.last_message = {"points": points}
+                        self.broadcast(self.last_message)
+                    if is_finished(self.build_id):
+                        self.close({"finished": True})
+                        return
+                    if self.is_stale():
+                        self.close({"stale": True})
+                        return
+                db_session.remove()
+                sleep(LIVE_POLL_INTERVAL)
+        except Exception as e:  # pylint: disable=W0703
+            self.close({"error": str(e)})
+        finally:
+            db_session.remove()
+
+
+def subscribe(app, build_id, test_name, lg_type, start_time, sampler="REQUEST"):
+    queue = Queue(maxsize=100)
+    with _pollers_lock:
+        poller = _pollers.get((build_id, test_name, lg_type, start_time, sampler))
+        if poller is None:
+            poller = BuildPoller(app, build_id, test_name, lg_type, start_time, sampler)
+            _pollers[poller.key] = poller
+            poller.subscribers.add(queue)
+            poller.start()
+        else:
+            poller.subscribers.add(queue)
+            if poller.last_message:
+                queue.put_nowait(poller.last_message)
+    return poller, queue
+
+
+def unsubscribe(poller, queue):
+    with _pollers_lock:
+        poller.subscribers.discard(queue)
+
+
+class EventStream:
+    """ Response body holding one of LIVE_MAX_STREAMS stream slots of the process until it is closed """
+
+    def __init__(self, events):
+        self.events = events
+        self.lock = Lock()
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.events)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        # server closes the body even if it was never iterated, the generator does not run its finally then
+        self.events.close()
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        _streams.release()
+
+
+def stream_events(build_id, test_name, lg_type, start_time, sampler="REQUEST"):
+    """
+    Server-Sent Events stream of the build metrics, to be called within the app context.
+    None if the process already serves LIVE_MAX_STREAMS streams, client is to poll charts with cursor then.
+    """
+    if not _streams.acquire(blocking=False):
+        return None
+    # the stream is consumed after the request is over, the poller gets the app to push its context itself
+    return EventStream(_events(current_app._get_current_object(), build_id, test_name, lg_type, start_time, sampler))
+
+
+def _events(app, build_id, test_name, lg_type, start_time, sampler):
+    poller, queue = subscribe(app, build_id, test_name, lg_type, start_time, sampler)
+    deadline = monotonic() + LIVE_STREAM_MAX_AGE
+    try:
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = queue.get(timeout=min(LIVE_KEEPALIVE_INTERVAL, remaining))
+            except Empty:
+                yield ": keepalive\n\n"
+                continue
+            if message is None:
+                break
+            yield f"data: {dumps(message)}\n\n"
+    finally:
+        unsubscribe(poller, queue)
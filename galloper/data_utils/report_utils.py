@@ -2,6 +2,10 @@ import random
 from datetime import datetime, timezone
 from galloper.constants import str_to_timestamp, MAX_DOTS_ON_CHART
 from galloper.dal.influx_results import calculate_auto_aggregation
+from galloper.data_utils.series import downsample_indices, encode_timeline, encode_values
+
+CHART_JS = "chartjs"
+COLUMNAR = "columnar"
 
 
 def colors(n):
@@ -24,38 +28,78 @@ def colors(n):
         return [(0, 0, 0)]
 
 
-def create_dataset(timeline, data, label, axe):
+def downsample(labels, datasets, max_points):
+    """ Timeline cut to about max_points, LTTB picks the points of every dataset so spikes are not lost """
+    if not max_points or len(labels) <= max_points:
+        return labels
+    indices = downsample_indices([dataset["data"] for dataset in datasets], max_points)
+    if not indices:
+        return labels
+    for dataset in datasets:
+        dataset["data"] = [dataset["data"][i] for i in indices if i < len(dataset["data"])]
+    return [labels[i] for i in indices if i < len(labels)]
+
+
+def columnar(timeline, datasets):
+    """ Timeline sent once as epoch offsets and every dataset as a typed array, see series.encode_values """
+    chart = {"format": "columnar", "datasets": []}
+    try:
+        chart["time"] = encode_timeline(timeline)
+    except (ValueError, TypeError):
+        # not a time axis, e.g. users of benchmark
+        chart["labels"] = timeline
+    for dataset in datasets:
+        encoded = {key: value for key, value in dataset.items() if key != "data"}
+        encoded.update(encode_values(dataset["data"]))
+        chart["datasets"].append(encoded)
+    return chart
+
+
+def format_labels(timeline):
+    """ '2021-01-02T03:04:05Z' -> '01-02 03:04:05', Influx timestamps are sliced, anything else goes to strptime """
     labels = []
     for _ in timeline:
-        labels.append(datetime.strptime(_, "%Y-%m-%dT%H:%M:%SZ").strftime("%m-%d %H:%M:%S"))
-    r, g, b = colors(1)[0]
+        if len(_) == 20 and _[10] == "T" and _[19] == "Z":
+            labels.append(f"{_[5:10]} {_[11:19]}")
+        else:
+            labels.append(datetime.strptime(_, "%Y-%m-%dT%H:%M:%SZ").strftime("%m-%d %H:%M:%S"))
+    return labels
+
+
+def render_chart(timeline, datasets, max_points=MAX_DOTS_ON_CHART, fmt=CHART_JS):
+    timeline = downsample(list(timeline), datasets, max_points)
+    if fmt == COLUMNAR:
+        return columnar(timeline, datasets)
+    try:
+        labels = format_labels(timeline)
+    except (ValueError, TypeError):
+        labels = timeline
     return {
         "labels": labels,
-        "datasets": [
-            {
-                "label": label,
-                "fill": False,
-                "data": list(data.values()),
-                "yAxisID": axe,
-                "borderWidth": 2,
-                "lineTension": 0,
-                "spanGaps": True,
-                "backgroundColor": f"rgb({r}, {g}, {b})",
-                "borderColor": f"rgb({r}, {g}, {b})"
-            }
-        ]
+        "datasets": datasets
     }
 
 
-def comparison_data(timeline, data):
-    labels = []
-    for _ in timeline:
-        labels.append(datetime.strptime(_, "%Y-%m-%dT%H:%M:%SZ").strftime("%m-%d %H:%M:%S"))
-    chart_data = {
-        "labels": labels,
-        "datasets": [
-        ]
-    }
+def create_dataset(timeline, data, label, axe, max_points=MAX_DOTS_ON_CHART, fmt=CHART_JS):
+    r, g, b = colors(1)[0]
+    datasets = [
+        {
+            "label": label,
+            "fill": False,
+            "data": list(data.values()),
+            "yAxisID": axe,
+            "borderWidth": 2,
+            "lineTension": 0,
+            "spanGaps": True,
+            "backgroundColor": f"rgb({r}, {g}, {b})",
+            "borderColor": f"rgb({r}, {g}, {b})"
+        }
+    ]
+    return render_chart(timeline, datasets, max_points, fmt)
+
+
+def comparison_data(timeline, data, max_points=MAX_DOTS_ON_CHART, fmt=CHART_JS):
+    datasets = []
     col = colors(len(data.keys()))
     for record in data:
         color = col.pop()
@@ -70,26 +114,17 @@ def comparison_data(timeline, data):
             "backgroundColor": f"rgb({color[0]}, {color[1]}, {color[2]})",
             "borderColor": f"rgb({color[0]}, {color[1]}, {color[2]})"
         }
-        chart_data["datasets"].append(dataset)
-    return chart_data
+        datasets.append(dataset)
+    return render_chart(timeline, datasets, max_points, fmt)
 
 
-def chart_data(timeline, users, other, yAxis="response_time"):
-    labels = []
-    try:
-        for _ in timeline:
-            labels.append(datetime.strptime(_, "%Y-%m-%dT%H:%M:%SZ").strftime("%m-%d %H:%M:%S"))
-    except:
-        labels = timeline
-    _data = {
-        "labels": labels,
-        "datasets": []
-    }
+def chart_data(timeline, users, other, yAxis="response_time", max_points=MAX_DOTS_ON_CHART, fmt=CHART_JS):
+    datasets = []
     if users:
-        _data['datasets'].append({"label": "Active Users", "fill": False,
-                                  "data": list(users['users'].values()),
-                                  "yAxisID": "active_users",
-                                  "borderWidth": 2, "lineTension": 0, "spanGaps": True})
+        datasets.append({"label": "Active Users", "fill": False,
+                         "data": list(users['users'].values()),
+                         "yAxisID": "active_users",
+                         "borderWidth": 2, "lineTension": 0, "spanGaps": True})
     colors_array = colors(len(other.keys()))
     for each in other:
         color = colors_array.pop()
@@ -110,8 +145,8 @@ def chart_data(timeline, users, other, yAxis="response_time"):
                 dataset['data'].append(other[each][str(_)])
             else:
                 dataset['data'].append(None)
-        _data['datasets'].append(dataset)
-    return _data
+        datasets.append(dataset)
+    return render_chart(timeline, datasets, max_points, fmt)
 
 
 def render_analytics_control(requests):
@@ -0,0 +1,256 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Saturation analysis of a test, done in memory over series which are pulled from Influx once per poll """
+
+from bisect import bisect_left
+from statistics import mean
+
+from galloper.constants import LIVE_CACHE_SIZE, LIVE_CACHE_TTL
+from galloper.dal.influx_results import get_tps, get_errors, get_backend_requests
+from galloper.data_utils import arrays
+from galloper.data_utils.series import overlap_buckets
+from galloper.utils.cache import TTLCache
+
+CALCULATIONS = {
+    'max': max,
+    'min': min,
+    'mean': mean,
+    'sum': sum
+}
+
+# (report id, sampler, request, status, aggregation, start time) -> series pulled by the previous poll
+_polls = TTLCache(maxsize=LIVE_CACHE_SIZE, ttl=LIVE_CACHE_TTL)
+
+
+class SaturationSeries:
+    """ 1s series of a test aligned on the same timeline """
+    FIELDS = ("throughput", "total", "response_time", "users")
+
+    def __init__(self, timestamps=(), **series):
+        self.timestamps = list(timestamps)
+        for field in self.FIELDS:
+            setattr(self, field, list(series.get(field, ())))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def extend(self, other):
+        """ New series with points of other appended, own points from the first timestamp of other on are dropped """
+        if not other.timestamps:
+            return self
+        cut = bisect_left(self.timestamps, other.timestamps[0])
+        return SaturationSeries(self.timestamps[:cut] + other.timestamps,
+                                **{field: getattr(self, field)[:cut] + getattr(other, field)
+                                   for field in self.FIELDS})
+
+
+def fetch_series(report, sampler, request, status, start_time, end_time):
+    timestamps, tps, users = get_tps(report.build_id, report.name, report.lg_type, start_time, end_time,
+                                     "1s", sampler, scope=request, status=status)
+    if not timestamps:
+        return SaturationSeries()
+    total = tps
+    if status != 'all':
+        _, total, _ = get_tps(report.build_id, report.name, report.lg_type, start_time, end_time,
+                              "1s", sampler, timestamps, users, scope=request)
+    _, rt, _ = get_backend_requests(report.build_id, report.name, report.lg_type, start_time, end_time,
+                                    "1s", sampler, timestamps, users, scope=request, status=status)
+    return SaturationSeries(timestamps,
+                            throughput=[tps["responses"][ts] for ts in timestamps],
+                            total=[total["responses"][ts] for ts in timestamps],
+                            response_time=[rt["response"][ts] for ts in timestamps],
+                            users=[users["users"][ts] for ts in timestamps])
+
+
+def fetch_errors(report, sampler, request, start_time, end_time, aggregation):
+    _, errors, _ = get_errors(report.build_id, report.name, report.lg_type, start_time, end_time,
+                              aggregation, sampler, scope=request)
+    return errors["errors"]
+
+
+def get_saturation_data(report, sampler, request, status, aggregation, start_time, end_time):
+    """
+    Series of the test between start_time and end_time along with errors per aggregation bucket.
+    Only the tail of the previous poll is queried again, its last LIVE_OVERLAP seconds could still get late points.
+    """
+    key = (report.id, sampler, request, status, aggregation, start_time)
+    cached = _polls.get(key)
+    if cached and len(cached[0]):
+        series, errors = cached
+        overlap = overlap_buckets(1)
+        tail_start = series.timestamps[-overlap] if len(series) >= overlap else start_time
+        series = series.extend(fetch_series(report, sampler, request, status, tail_start, end_time))
+        overlap = overlap_buckets(bucket_size(aggregation))
+        cursor = list(errors)[-overlap] if len(errors) >= overlap else start_time
+        tail = fetch_errors(report, sampler, request, cursor, end_time, aggregation)
+        errors = {ts: value for ts, value in errors.items() if ts < cursor}
+        errors.update(tail)
+    else:
+        series = fetch_series(report, sampler, request, status, start_time, end_time)
+        errors = fetch_errors(report, sampler, request, start_time, end_time, aggregation)
+    _polls.set(key, (series, errors))
+    return series, errors
+
+
+def part(data, part):
+    data = sorted(data)
+    n = len(data)
+    if n <= part or part == 1:
+        return data[-1]
+    parts = n // part
+    return data[parts * (part - 1)]
+
+
+def bucket_size(aggregation):
+    if 'm' in aggregation:
+        return int(aggregation.replace('m', '')) * 60
+    elif 's' in aggregation:
+        return int(aggregation.replace('s', ''))
+    return 60
+
+
+def aggregate_throughput(series, size, calculation):
+    """ Throughput folded into buckets of size points, each labelled with users at its last point """
+    tps = []
+    usrs = []
+    _tmp = []
+    for index, value in enumerate(series.throughput):
+        if isinstance(value, int):
+            _tmp.append(value)
+        if len(_tmp) == size:
+            tps.append(round(calculation(_tmp)))
+            usrs.append(series.users[index])
+            _tmp = []
+    if _tmp:
+        tps.append(round(calculation(_tmp)))
+        usrs.append(series.users[-1])
+    return tps, usrs
+
+
+def step_throughput(values, size, calculation):
+    tp = [0 if v is None else v for v in values]
+    if not tp:
+        return 0
+    coefficient = float(len(tp) / size) if len(tp) != size else 1
+    return int(calculation(tp) / coefficient)
+
+
+def step_response_time(values, u_aggr):
+    rt = [v for v in values if v and v > 0]
+    return part(rt, u_aggr) if rt else 0
+
+
+def benchmark(series, response, user_array, max_users, current_users, size, calculation, u_aggr):
+    """ Throughput and response time for every users step, the step ends when users go above its value """
+    uber_array = {}
+    u = user_array.pop()
+    start = 0
+    response["test_start"] = series.timestamps[0]
+    response["test_end"] = series.timestamps[-1]
+    for index, value in enumerate(series.users):
+        if value > u and max_users >= u:
+            # the point users went up at belongs to the next step
+            tp = step_throughput(series.throughput[start:index], size, calculation)
+            if round(tp, 2) > response["max_throughput"] and u != current_users:
+                response["max_throughput"] = round(tp, 2)
+                response["max_users"] = u
+                current_users = u + u_aggr
+                response["current_users"] = current_users
+            rt = step_response_time(series.response_time[start:index], u_aggr)
+            uber_array[str(u)] = {
+                "throughput": round(tp, 2),
+                "response_time": round(rt, 2)
+            }
+            start = index
+            u = user_array.pop()
+    if str(response["max_users"]) not in list(uber_array.keys()):
+        rt = step_response_time(series.response_time[start:len(series) - 1], u_aggr)
+        uber_array[str(max_users)] = {
+            "throughput": response["max_throughput"],
+            "response_time": round(rt, 2)
+        }
+    else:
+        uber_array[str(response["max_users"])]["throughput"] = response["max_throughput"]
+    if str(current_users) not in list(uber_array.keys()):
+        uber_array[str(current_users)] = {
+            "throughput": response["current_throughput"],
+            "response_time": uber_array.get(str(max_users), list(uber_array.values())[-1])["response_time"]
+        }
+    else:
+        uber_array[str(current_users)]["throughput"] = response["current_throughput"]
+    return uber_array
+
+
+def analyse(series, errors, args):
+    size = bucket_size(args["aggregation"])
+    calculation = CALCULATIONS.get(args['calculation'], sum)
+    tps, usrs = aggregate_throughput(series, size, calculation)
+    total = sum(v for v in series.total if v)
+    if not total:
+        return {"message": "not enough results", "code": 0}
+    error_rate = float(sum(v for v in errors.values() if v)) / float(total) * 100
+    try:
+        max_tp, user_index = arrays.non_decreasing(tps[:-1], deviation=args["deviation"], val=True)
+        max_users = args["u_aggr"] * round(usrs[user_index] / args["u_aggr"])
+        max_tp = tps[user_index]
+        current_users = args["u_aggr"] * round(usrs[user_index + 1] / args["u_aggr"])
+        if current_users == max_users:
+            current_users += args["u_aggr"]
+        if current_users == 0:
+            current_users = max_users + args["u_aggr"]
+        if current_users < max_users:
+            current_users = max_users + args["u_aggr"]
+    except TypeError:
+        return {"message": "not enough results", "code": 0}
+    except IndexError:
+        if error_rate > args["max_errors"]:
+            return {"message": f"error rate reached 100% for {args['request']} transaction", "errors_rate": 100.0,
+                    "code": 1}
+        else:
+            return {"message": "not enough results", "code": 0}
+
+    response = {
+        "ts": series.timestamps[-1],
+        "max_users": max_users,
+        "max_throughput": round(max_tp, 2),
+        "current_users": current_users,
+        "current_throughput": round(tps[user_index], 2),
+        "errors_rate": round(error_rate, 2)
+    }
+    if args["u"]:
+        user_array = list(args["u"])
+        if max_users not in user_array:
+            user_array.append(max_users)
+        if current_users not in user_array:
+            user_array.append(current_users)
+        user_array.sort()
+        user_array.reverse()
+        response["benchmark"] = benchmark(series, response, user_array, max_users, current_users, size,
+                                          calculation, args["u_aggr"])
+    if args["extended_output"]:
+        response["details"] = {}
+        response["tps"] = tps
+        for index, value in enumerate(usrs):
+            if not response["details"].get(value) or response["details"][value] > tps[index]:
+                response["details"][value] = tps[index]
+    if (arrays.non_decreasing(tps[:-1], deviation=args["deviation"]) and
+            error_rate <= args["max_errors"] and
+            response["current_throughput"] * (1 + args["max_deviation"]) >= response["max_throughput"]):
+        response["message"] = "proceed"
+        response["code"] = 0
+    else:
+        response["message"] = "saturation"
+        response["code"] = 1
+    return response
@@ -0,0 +1,142 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from base64 import b64encode
+
+import numpy as np
+
+from galloper.constants import LIVE_OVERLAP
+
+
+def aggregation_to_seconds(aggregation):
+    """ '30s' -> 30, '5m' -> 300 """
+    if 'm' in aggregation:
+        return int(aggregation.replace('m', '')) * 60
+    return int(aggregation.replace('s', ''))
+
+
+def overlap_buckets(bucket_seconds, overlap=LIVE_OVERLAP):
+    """ Number of trailing buckets of bucket_seconds covering overlap seconds, at least the last one """
+    return max(1, -(-overlap // bucket_seconds))
+
+
+class Series:
+    """ Time series held as lists of timestamps and values, indexed by timestamp on first lookup """
+
+    def __init__(self, timestamps, values):
+        self.timestamps = list(timestamps)
+        self.values = list(values)
+        self._index = None
+
+    @classmethod
+    def from_points(cls, points, field, fill=0):
+        """ Build series from Influx points, missing values are replaced with fill """
+        timestamps = []
+        values = []
+        for point in points:
+            timestamps.append(point['time'])
+            values.append(point[field] if point[field] is not None else fill)
+        return cls(timestamps, values)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def index(self, timestamp):
+        """ Position of the timestamp in the series, None if it is not there """
+        if self._index is None:
+            self._index = {ts: i for i, ts in enumerate(self.timestamps)}
+        return self._index.get(timestamp)
+
+    def unique_timestamps(self):
+        return list(dict.fromkeys(self.timestamps))
+
+    def align(self, timestamps, fill=None):
+        """ Values on the given timeline, fill where the series has no point """
+        result = {}
+        for ts in timestamps:
+            i = self.index(ts)
+            result[ts] = fill if i is None else self.values[i]
+        return result
+
+
+def lttb(values, threshold):
+    """
+    Indices of the points picked by Largest-Triangle-Three-Buckets, first and last points are always kept.
+    Missing values are treated as zeros when picking, so gaps do not hide the points around them.
+    """
+    y = np.nan_to_num(np.asarray(values, dtype=float))
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    picked = np.empty(threshold, dtype=int)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            avg_x, avg_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def downsample_indices(series, threshold):
+    """ Sorted timeline positions to keep, the points budget is shared by all the series drawn on one chart """
+    series = [values for values in series if len(values)]
+    if not series:
+        return []
+    budget = max(threshold // len(series), 3)
+    picked = set()
+    for values in series:
+        picked.update(lttb(values, budget).tolist())
+    return sorted(picked)
+
+
+def _b64(array):
+    return b64encode(array.tobytes()).decode("ascii")
+
+
+def encode_timeline(timeline):
+    """ RFC3339 timestamps as epoch seconds of the first one plus little-endian int32 offsets, base64 encoded """
+    epochs = np.array([ts[:19] for ts in timeline], dtype="datetime64[s]").astype(np.int64)
+    start = int(epochs[0]) if len(epochs) else 0
+    return {"start": start, "offsets": _b64((epochs - start).astype("<i4"))}
+
+
+def encode_values(values):
+    """
+    Series as base64 typed array: delta encoded little-endian int32 when all values are integers,
+    float32 otherwise. Missing values are zeros in the array and set bits (little bit order) in the nulls bitmap.
+    """
+    nulls = np.array([value is None for value in values], dtype=bool)
+    filled = [0 if value is None else value for value in values]
+    encoded = {"nulls": _b64(np.packbits(nulls, bitorder="little")) if nulls.any() else None}
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in filled):
+        deltas = np.diff(np.asarray(filled, dtype=np.int64), prepend=0)
+        if not len(deltas) or (deltas.min() >= np.iinfo(np.int32).min and deltas.max() <= np.iinfo(np.int32).max):
+            encoded.update(encoding="delta-int32", data=_b64(deltas.astype("<i4")))
+            return encoded
+    encoded.update(encoding="float32", data=_b64(np.asarray(filled, dtype="<f4")))
+    return encoded
+
+
+def epochs_to_labels(epochs):
+    """ Epoch seconds to UTC '%m-%d %H:%M:%S' chart labels, all at once """
+    iso = np.datetime_as_string(np.asarray(epochs, dtype=np.float64).astype(np.int64).astype("datetime64[s]"))
+    return [f"{ts[5:10]} {ts[11:19]}" for ts in iso.tolist()]
@@ -0,0 +1,104 @@
+#   Copyright 2021 getcarrier.io
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+""" Steps flow graph of UI test results: nodes are unique steps, edges are transitions between them in sessions """
+
+from galloper.data_utils.arrays import get_aggregated_data, closest
+
+START_IDENTIFIER = "start_point"
+
+
+def start_node():
+    return {"data": {"id": 'start', "name": 'Start', "identifier": START_IDENTIFIER, "session_id": "start"}}
+
+
+def result_to_node(res):
+    return {
+        "data": {
+            "id": res.id,
+            "name": res.name,
+            "session_id": res.session_id,
+            "identifier": res.identifier,
+            "type": res.type,
+            "status": "passed",
+            "result_id": res.id,
+            "file": f"/api/v1/artifacts/{res.project_id}/reports/{res.file_name}"
+        }
+    }
+
+
+def make_edge(node_from, node_to):
+    return {
+        "data": {
+            "source": node_from['data']['id'],
+            "target": node_to['data']['id'],
+            "session_id": node_from['data']['session_id'],
+            "id_to": node_to['data']['identifier'],
+            "time": ""
+        },
+        "classes": ""
+    }
+
+
+def assert_threshold(steps, aggregation, metric="total"):
+    """ identifier -> status, closest to aggregated metric result and the aggregated metric of the step """
+    threshold_results = {}
+    for identifier, values in steps.items():
+        aggregated_total = get_aggregated_data(aggregation, values, metric)
+        thresholds_failed = sum(d.thresholds_failed for d in values)
+        threshold_results[identifier] = {"status": "failed" if thresholds_failed > 0 else "passed",
+                                         "data": closest(values, aggregated_total), "time": aggregated_total}
+    return threshold_results
+
+
+def build_graph(project_id, results, aggregation, metric="total"):
+    """
+    Nodes and edges of the steps graph, linear in the number of results.
+    Node of a step is made of its first result, edges are deduplicated by (source, target) and
+    the first edge leading to a step gets its aggregated time and threshold status.
+    """
+    nodes = {START_IDENTIFIER: start_node()}
+    steps = {}
+    sessions = {}
+    for result in results:
+        if result.identifier not in nodes:
+            nodes[result.identifier] = result_to_node(result)
+            steps[result.identifier] = []
+        steps[result.identifier].append(result)
+        sessions.setdefault(result.session_id, []).append(result.identifier)
+
+    edges = {}
+    edges_to = {}
+    for identifiers in sessions.values():
+        current_node = nodes[START_IDENTIFIER]
+        for identifier in identifiers:
+            upcoming_node = nodes[identifier]
+            key = (current_node['data']['id'], upcoming_node['data']['id'])
+            if key not in edges:
+                edges[key] = make_edge(current_node, upcoming_node)
+                edges_to.setdefault(identifier, edges[key])
+            current_node = upcoming_node
+
+    for identifier, threshold_result in assert_threshold(steps, aggregation, metric).items():
+        node = nodes[identifier]
+        status = threshold_result['status']
+        node['status'] = status
+        node['file'] = f"/api/v1/artifacts/{project_id}/reports/{threshold_result['data'].file_name}"
+        edge = edges_to.get(identifier)
+        if edge:
+            edge['data']['time'] = round(threshold_result['time'] / 1000, 2)
+            edge["classes"] = status
+
+    return list(nodes.values()), list(edges.values())
+
@@ -34,6 +34,7 @@ def init_db():
     # you will have to import them first before calling init_db()
     from .models import api_release
     from .models import api_reports
+    from .models import api_report_rollup
     from .models import project
     from .models import project_quota
     from .models import security_details
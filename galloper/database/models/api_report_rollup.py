@@ -0,0 +1,48 @@
+#     Copyright 2021 getcarrier.io
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from sqlalchemy import String, Column, Integer, Float, Index
+
+from galloper.database.db_manager import Base
+from galloper.database.abstract_base import AbstractBaseMixin
+
+
+class APIReportRollup(AbstractBaseMixin, Base):
+    """
+    Aggregates of a finished test for every combination of sampler, request and status.
+    Empty sampler stands for all samplers, request_name 'All' for all requests and status 'all' for any status.
+    """
+    __tablename__ = "api_report_rollup"
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, unique=False, nullable=False)
+    report_id = Column(Integer, unique=False, nullable=False)
+    build_id = Column(String(128), unique=False, nullable=False, index=True)
+    aggregation = Column(String(16), unique=False, nullable=False)
+    sampler = Column(String(128), unique=False, nullable=False)
+    request_name = Column(String(256), unique=False, nullable=False)
+    status = Column(String(16), unique=False, nullable=False)
+    total = Column(Integer, unique=False)
+    errors = Column(Integer, unique=False)
+    throughput = Column(Float, unique=False)
+    _min = Column(Float, unique=False)
+    _max = Column(Float, unique=False)
+    median = Column(Float, unique=False)
+    pct95 = Column(Float, unique=False)
+    pct99 = Column(Float, unique=False)
+
+
+# one row per combination, concurrent builds of the same rollups can not duplicate them
+Index("ux_api_report_rollup_key", APIReportRollup.build_id, APIReportRollup.aggregation, APIReportRollup.sampler,
+      APIReportRollup.request_name, APIReportRollup.status, unique=True)
@@ -12,7 +12,7 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from sqlalchemy import String, Column, Integer, Text
+from sqlalchemy import String, Column, Integer, Text, LargeBinary, Index
 
 from galloper.database.db_manager import Base
 from galloper.database.abstract_base import AbstractBaseMixin
@@ -25,3 +25,8 @@ class SecurityDetails(AbstractBaseMixin, Base):
     project_id = Column(Integer, unique=False, nullable=False)
     detail_hash = Column(String(128), unique=False)
     details = Column(Text, unique=False)
+    # zlib packed details, see galloper.dal.findings.pack_details
+    compressed = Column(LargeBinary, unique=False, nullable=True)
+
+
+Index("ix_security_details_project_hash", SecurityDetails.project_id, SecurityDetails.detail_hash)
@@ -12,7 +12,7 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from sqlalchemy import String, Column, Integer, Text
+from sqlalchemy import String, Column, Integer, Text, Index
 
 from galloper.database.db_manager import Base
 from galloper.database.abstract_base import AbstractBaseMixin
@@ -33,3 +33,8 @@ class SecurityReport(AbstractBaseMixin, Base):
     false_positive = Column(Integer, unique=False)
     info_finding = Column(Integer, unique=False)
     excluded_finding = Column(Integer, unique=False)
+
+
+Index("ix_security_report_project_issue", SecurityReport.project_id, SecurityReport.issue_hash)
+Index("ix_security_report_report_false_positive", SecurityReport.report_id, SecurityReport.false_positive)
+Index("ix_security_report_report_excluded", SecurityReport.report_id, SecurityReport.excluded_finding)
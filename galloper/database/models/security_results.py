@@ -12,7 +12,7 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from sqlalchemy import String, Column, Integer
+from sqlalchemy import String, Column, Integer, Index
 
 from galloper.database.db_manager import Base
 from galloper.database.abstract_base import AbstractBaseMixin
@@ -35,3 +35,7 @@ class SecurityResults(AbstractBaseMixin, Base):
     excluded = Column(Integer, unique=False)
     info_findings = Column(Integer, unique=False)
     environment = Column(String(32), unique=False, nullable=False)
+
+
+Index("ix_security_results_application", SecurityResults.project_id, SecurityResults.project_name,
+      SecurityResults.app_name, SecurityResults.scan_type)
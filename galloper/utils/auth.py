@@ -13,16 +13,21 @@
 #     limitations under the License.
 
 from functools import wraps
+from hashlib import sha256
 from typing import Optional
-from json import loads
+from json import loads, dumps
 
-from flask import session, redirect, url_for, current_app, request
+from flask import session, redirect, url_for, current_app, request, g
 from werkzeug.exceptions import NotFound
-from requests import get
-from galloper.constants import APP_HOST
+from galloper.utils.cache import TTLCache
+from galloper.utils.http import get_session
+from galloper.constants import APP_HOST, AUTH_CACHE_SIZE, AUTH_CACHE_TTL
 
 from galloper.config import Config
 
+# digest of Authorization and Cookie headers -> forward-auth identity
+_users_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
 
 class SessionProject:
     PROJECT_CACHE_KEY = Config().PROJECT_CACHE_KEY
@@ -103,13 +108,22 @@ def _get_user_data():
     if current_app.config['DEV']:
         return {"groups": ["/superadmin"]}
     user_data = SessionUser.get()
+    if not user_data:
+        user_data = g.get("user_data")
     if not user_data:
         headers = {}
         for header in request.headers:
             if header[0].lower() in ["cookie", "authorization"]:
                 headers[header[0]] = header[1]
-        headers["Content-Type"] = "application/json"
-        user_data = get(f"{APP_HOST}/forward-auth/me", headers=headers).json()
+        # identity is cached by credentials digest, so raw tokens are not kept in memory
+        key = sha256(dumps(sorted(headers.items())).encode("utf-8")).hexdigest()
+        user_data = _users_cache.get(key)
+        if not user_data:
+            headers["Content-Type"] = "application/json"
+            user_data = get_session().get(f"{APP_HOST}/forward-auth/me", headers=headers).json()
+            if isinstance(user_data, dict) and "groups" in user_data:
+                _users_cache.set(key, user_data)
+        g.user_data = user_data
     return user_data
 
 
@@ -0,0 +1,72 @@
+#     Copyright 2021 getcarrier.io
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid
+from threading import Lock, local
+from typing import Callable, Iterable, List
+
+from flask import current_app, has_app_context
+
+from galloper.constants import FAN_OUT_WORKERS
+from galloper.database.db_manager import config, db_session
+
+_executors = {}
+_executors_lock = Lock()
+_worker = local()
+
+
+def _max_workers() -> int:
+    """ Every worker holds a DB connection, the ones of request threads have to fit the engine pool too """
+    pool_size = config.db_engine_config.get("pool_size")
+    return max(1, min(FAN_OUT_WORKERS, pool_size // 2)) if pool_size else FAN_OUT_WORKERS
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """ Executor shared by all requests of the process, forked processes get their own one """
+    pid = getpid()
+    executor = _executors.get(pid)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(pid)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=_max_workers(), thread_name_prefix="fan_out")
+                _executors[pid] = executor
+    return executor
+
+
+def fan_out(func: Callable, items: Iterable) -> List:
+    """
+    Call func for every item concurrently on the executor shared by the process, so the number of
+    threads and DB connections they take is bounded however many requests fan out at the same time.
+    Results keep the order of items, the first exception raised by func is re-raised.
+    Nested calls run in the calling worker, waiting for the shared executor there could deadlock it.
+    """
+    items = list(items)
+    if len(items) < 2 or getattr(_worker, "active", False):
+        return [func(item) for item in items]
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def call(item):
+        _worker.active = True
+        try:
+            if app is None:
+                return func(item)
+            with app.app_context():
+                return func(item)
+        finally:
+            _worker.active = False
+            db_session.remove()
+
+    return list(get_executor().map(call, items))
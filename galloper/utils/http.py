@@ -0,0 +1,55 @@
+#     Copyright 2021 getcarrier.io
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from os import getpid
+from threading import Lock
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from galloper.constants import HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_BACKOFF, HTTP_TIMEOUT
+
+_sessions = {}
+_sessions_lock = Lock()
+
+
+class PooledSession(Session):
+    """ Session with retries on connection errors and 5xx of idempotent requests, and default timeouts """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES, timeout=HTTP_TIMEOUT) -> None:
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=HTTP_BACKOFF, status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> PooledSession:
+    """ Session shared by all threads of the process, forked processes get their own one """
+    pid = getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(pid)
+            if session is None:
+                _sessions.clear()
+                session = _sessions[pid] = PooledSession()
+    return session
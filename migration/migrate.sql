@@ -50,3 +50,12 @@ ALTER TABLE ui_result ADD COLUMN tbt INTEGER DEFAULT 0;
 ALTER TABLE ui_result ADD COLUMN fvc INTEGER DEFAULT 0;
 ALTER TABLE ui_result ADD COLUMN lvc INTEGER DEFAULT 0;
 ALTER TABLE ui_result ADD COLUMN tti INTEGER DEFAULT 0;
+
+ALTER TABLE security_details ADD COLUMN compressed BYTEA;
+
+CREATE INDEX IF NOT EXISTS ix_security_report_project_issue ON security_report (project_id, issue_hash);
+CREATE INDEX IF NOT EXISTS ix_security_report_report_false_positive ON security_report (report_id, false_positive);
+CREATE INDEX IF NOT EXISTS ix_security_report_report_excluded ON security_report (report_id, excluded_finding);
+CREATE INDEX IF NOT EXISTS ix_security_details_project_hash ON security_details (project_id, detail_hash);
+CREATE INDEX IF NOT EXISTS ix_security_results_application ON security_results (project_id, project_name, app_name, scan_type);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_api_report_rollup_key ON api_report_rollup (build_id, aggregation, sampler, request_name, status);